@@ -1,23 +1,82 @@
+from __future__ import annotations
+
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Literal, List
-from openai import OpenAI
+from pydantic import BaseModel, model_validator
+from typing import Literal, List, Optional
+import asyncio
 import json
-import numpy as np
+import math
 import subprocess, os, time, tempfile
-from google import genai  # pip install google-genai
-import yt_dlp
+import threading
+import multiprocessing
+import queue
+import signal
+import functools
+import hashlib
+import sqlite3
+import unicodedata
+import re
+import shutil
+import uuid
+from urllib.parse import parse_qs
+from datetime import datetime, timezone
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 import mimetypes
 import sys
 from io import StringIO
 import traceback
-import requests
+import cProfile
+import pstats
+import tracemalloc
+import random
+import importlib
+from urllib.parse import urlsplit
+
+# ---------------------------
+# Deferred heavy imports
+# ---------------------------
+class LazyModule:
+    """
+    Stands in for a heavy module until one of its attributes is first read,
+    so a cold start only imports what the request being served needs.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+np = LazyModule("numpy")
+requests = LazyModule("requests")
+openai = LazyModule("openai")
+genai = LazyModule("google.genai")  # pip install google-genai
+yt_dlp = LazyModule("yt_dlp")
 
 # ---------------------------
 # Vercel-compatible FastAPI app
 # ---------------------------
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Fork the code interpreter workers (code_pool, defined below) before serving,
+    # so the first snippets find them warm
+    code_pool.start()
+    yield
+    code_pool.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for POST from any origin
 app.add_middleware(
@@ -29,43 +88,678 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# ---------------------------
+# Blocking work offload
+# ---------------------------
+# Handlers are async, so any blocking SDK call, download or sleep must run
+# here instead of on the event loop. The pool size bounds how many run at once.
+blocking_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BLOCKING_WORKERS", "32")), thread_name_prefix="blocking"
+)
+
+async def run_blocking(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(blocking_executor, functools.partial(fn, *args, **kwargs))
+
+# ---------------------------
+# Outbound HTTP layer
+# ---------------------------
+OUTBOUND_POOL_SIZE = int(os.getenv("OUTBOUND_POOL_SIZE", "32"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_HOST_CONCURRENCY = int(os.getenv("OUTBOUND_HOST_CONCURRENCY", "16"))
+
+# Per-endpoint timeouts in seconds ((connect, read) where requests allows it)
+AIPIPE_OPENAI_TIMEOUT = float(os.getenv("AIPIPE_OPENAI_TIMEOUT", "30"))
+AIPIPE_GEMINI_TIMEOUT = (5.0, float(os.getenv("AIPIPE_GEMINI_TIMEOUT", "30")))
+
+class OutboundHTTP:
+    """
+    Shared requests.Session for upstream APIs: pooled keep-alive connections,
+    bounded retries with jittered exponential backoff on 429/5xx and
+    connection errors, and a cap on concurrent requests per host.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, pool_size: int, max_retries: int, host_concurrency: int,
+                 backoff: float = 0.5, max_backoff: float = 8.0):
+        self.max_retries = max_retries
+        self.host_concurrency = host_concurrency
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self.pool_size = pool_size
+        self._session = None
+        self._host_slots = {}
+        self._async_host_slots = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        # Built on the first upstream call, not at import
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _slot(self, slots: dict, url: str, factory):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in slots:
+                slots[host] = factory(self.host_concurrency)
+            return slots[host]
+
+    def host_slot(self, url: str) -> threading.BoundedSemaphore:
+        return self._slot(self._host_slots, url, threading.BoundedSemaphore)
+
+    def async_host_slot(self, url: str) -> asyncio.Semaphore:
+        """Same per-host cap for calls made by async SDK clients."""
+        return self._slot(self._async_host_slots, url, asyncio.Semaphore)
+
+    def _delay(self, attempt: int, response) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        # Full jitter keeps retrying workers from synchronizing
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method: str, url: str, *, timeout, **kwargs) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            response = None
+            with self.host_slot(url):
+                try:
+                    response = self.session.request(method, url, timeout=timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.max_retries:
+                        raise
+            if response is not None and (
+                response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries
+            ):
+                return response
+            self.retries += 1
+            time.sleep(self._delay(attempt, response))
+
+    def post(self, url: str, *, timeout, **kwargs) -> requests.Response:
+        return self.request("POST", url, timeout=timeout, **kwargs)
+
+outbound = OutboundHTTP(OUTBOUND_POOL_SIZE, OUTBOUND_MAX_RETRIES, OUTBOUND_HOST_CONCURRENCY)
+
+# ---------------------------
+# Request coalescing
+# ---------------------------
+
+class LeaderCancelled(Exception):
+    """The caller running a coalesced call was cancelled before it finished."""
+
+class SingleFlight:
+    """
+    While a call for a key is in flight, later callers with the same key await
+    its result (or its exception) instead of starting their own upstream call.
+    If the caller running the call is cancelled, the first waiter to wake up
+    starts it again and the rest wait on that one.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def do(self, key, fn):
+        joined = False
+        while (future := self._inflight.get(key)) is not None:
+            if not joined:
+                self.coalesced += 1
+                joined = True
+            try:
+                # shield: one waiter being cancelled must not cancel the shared call
+                return await asyncio.shield(future)
+            except LeaderCancelled:
+                continue
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self.calls += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
+
 # ---------------------------
 # Load telemetry data 
 # ---------------------------
-try:
-    with open("q-vercel-latency.json", "r", encoding="utf-8") as f:
-        telemetry = json.load(f)
-except FileNotFoundError:
-    telemetry = []
+
+def percentile_sorted(values: np.ndarray, q: float) -> float:
+    """np.percentile (linear interpolation) on an already sorted array, in O(1)."""
+    rank = (len(values) - 1) * (q / 100.0)  # same operation order as numpy
+    lo = int(np.floor(rank))
+    hi = min(lo + 1, len(values) - 1)
+    # Same lerp numpy uses, so rounded results match np.percentile exactly
+    t = rank - lo
+    diff = values[hi] - values[lo]
+    if t >= 0.5:
+        return float(values[hi] - diff * (1 - t))
+    return float(values[lo] + diff * t)
+
+def latency_summary(latency_sorted: np.ndarray, latency_sum: float, uptime_sum: float, threshold: float,
+                    thresholds: tuple = (), buckets: tuple = ()) -> dict:
+    n = len(latency_sorted)
+    # Everything strictly above the threshold sits at the tail of the sorted view
+    breaches = n - int(np.searchsorted(latency_sorted, threshold, side="right"))
+    summary = {
+        "avg_latency": round(latency_sum / n, 2),
+        "p95_latency": round(percentile_sorted(latency_sorted, 95), 2),
+        "avg_uptime": round(uptime_sum / n, 3),
+        "breaches": breaches,
+    }
+    # Sweeps and histograms are one vectorized binary search over the same sorted view
+    if thresholds:
+        summary["threshold_breaches"] = (n - np.searchsorted(latency_sorted, thresholds, side="right")).tolist()
+    if buckets:
+        summary["histogram"] = np.diff(np.searchsorted(latency_sorted, buckets, side="right")).tolist()
+    return summary
+
+class RegionTelemetry:
+    """
+    Columns for one region (or one region/service pair), ordered by
+    timestamp, plus the pre-sorted latency view and running sums the
+    whole-range metrics need. The arrays may be memory-mapped views.
+    """
+
+    def __init__(self, timestamp: np.ndarray, latency: np.ndarray, uptime: np.ndarray,
+                 latency_sorted: np.ndarray, latency_sum: float, uptime_sum: float,
+                 services_loader=None):
+        self.timestamp = timestamp
+        self.latency = latency
+        self.uptime = uptime
+        self.latency_sorted = latency_sorted
+        self.latency_sum = latency_sum
+        self.uptime_sum = uptime_sum
+        self._services_loader = services_loader
+        self._services = None
+
+    @classmethod
+    def from_ordered(cls, timestamp: np.ndarray, latency: np.ndarray, uptime: np.ndarray) -> "RegionTelemetry":
+        """Build from columns that are already in timestamp order."""
+        return cls(timestamp, latency, uptime, np.sort(latency), float(np.sum(latency)), float(np.sum(uptime)))
+
+    @property
+    def services(self) -> dict:
+        """Per-service views of this region, materialized on first use."""
+        if self._services is None:
+            self._services = self._services_loader() if self._services_loader else {}
+        return self._services
+
+    def __len__(self) -> int:
+        return len(self.latency)
+
+    def time_slice(self, start=None, end=None) -> slice:
+        """Rows with start <= timestamp <= end, found by binary search."""
+        lo = 0 if start is None else int(np.searchsorted(self.timestamp, start, side="left"))
+        hi = len(self.timestamp) if end is None else int(np.searchsorted(self.timestamp, end, side="right"))
+        return slice(lo, max(lo, hi))
+
+    def metrics(self, threshold: float, start=None, end=None, thresholds: tuple = (), buckets: tuple = ()):
+        if start is None and end is None:
+            return latency_summary(
+                self.latency_sorted, self.latency_sum, self.uptime_sum, threshold, thresholds, buckets
+            )
+
+        rows = self.time_slice(start, end)
+        if rows.start == rows.stop:
+            return None
+        latency = self.latency[rows]
+        return latency_summary(
+            np.sort(latency), float(np.sum(latency)), float(np.sum(self.uptime[rows])), threshold,
+            thresholds, buckets,
+        )
+
+# Columnar telemetry layout, shared by the in-memory index and the on-disk store.
+# Rows are ordered by (region, timestamp), so every region is one contiguous
+# block; region/service blocks are reached through the service_rows permutation.
+TELEMETRY_COLUMNS = ("timestamp", "latency", "uptime", "latency_sorted", "service_rows")
+TELEMETRY_STORE = os.getenv("TELEMETRY_STORE", "q-vercel-latency.store")
+
+def build_telemetry_columns(records: list):
+    """Dictionary-encode and sort raw telemetry records into (columns, dictionary)."""
+    region_names, region_codes = np.unique(
+        np.array([r["region"] for r in records]), return_inverse=True
+    )
+    service_names, service_codes = np.unique(
+        np.array([r["service"] for r in records]), return_inverse=True
+    )
+    count = len(records)
+    latency = np.fromiter((r["latency_ms"] for r in records), dtype=np.float64, count=count)
+    uptime = np.fromiter((r["uptime_pct"] for r in records), dtype=np.float64, count=count)
+    timestamp = np.fromiter((r["timestamp"] for r in records), dtype=np.int64, count=count)
+
+    order = np.lexsort((timestamp, region_codes))
+    region_codes, service_codes = region_codes[order], service_codes[order]
+    timestamp, latency, uptime = timestamp[order], latency[order], uptime[order]
+
+    region_offsets = np.searchsorted(region_codes, np.arange(len(region_names) + 1))
+    service_rows = np.lexsort((timestamp, service_codes, region_codes))
+    group_keys = (region_codes * len(service_names) + service_codes)[service_rows]
+    service_offsets = np.searchsorted(group_keys, np.arange(len(region_names) * len(service_names) + 1))
+
+    columns = {
+        "timestamp": timestamp,
+        "latency": latency,
+        "uptime": uptime,
+        "latency_sorted": latency[np.lexsort((latency, region_codes))],
+        "service_rows": service_rows,
+    }
+    blocks = list(zip(region_offsets[:-1], region_offsets[1:]))
+    dictionary = {
+        "regions": [str(r) for r in region_names],
+        "services": [str(s) for s in service_names],
+        "region_offsets": region_offsets.tolist(),
+        "service_offsets": service_offsets.tolist(),
+        "latency_sum": [float(np.sum(latency[lo:hi])) for lo, hi in blocks],
+        "uptime_sum": [float(np.sum(uptime[lo:hi])) for lo, hi in blocks],
+    }
+    return columns, dictionary
+
+def index_telemetry_columns(columns: dict, dictionary: dict) -> dict:
+    """Wrap each region block of the columns in a RegionTelemetry view (no copies)."""
+    services = dictionary["services"]
+    service_offsets = dictionary["service_offsets"]
+
+    def services_loader(code: int):
+        def load():
+            result = {}
+            for s, service in enumerate(services):
+                lo, hi = service_offsets[code * len(services) + s], service_offsets[code * len(services) + s + 1]
+                if lo == hi:
+                    continue
+                rows = columns["service_rows"][lo:hi]
+                result[service] = RegionTelemetry.from_ordered(
+                    columns["timestamp"][rows], columns["latency"][rows], columns["uptime"][rows]
+                )
+            return result
+        return load
+
+    index = {}
+    offsets = dictionary["region_offsets"]
+    for code, region in enumerate(dictionary["regions"]):
+        block = slice(offsets[code], offsets[code + 1])
+        index[region] = RegionTelemetry(
+            columns["timestamp"][block],
+            columns["latency"][block],
+            columns["uptime"][block],
+            columns["latency_sorted"][block],
+            dictionary["latency_sum"][code],
+            dictionary["uptime_sum"][code],
+            services_loader(code),
+        )
+    return index
+
+def build_telemetry_index(records: list) -> dict:
+    """Group raw telemetry records once into per-region (and per-service) columnar arrays."""
+    if not records:
+        return {}
+    return index_telemetry_columns(*build_telemetry_columns(records))
+
+def convert_telemetry(json_path: str = "q-vercel-latency.json", store_path: str = TELEMETRY_STORE):
+    """One-shot conversion of the JSON telemetry into the binary column store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        columns, dictionary = build_telemetry_columns(json.load(f))
+    os.makedirs(store_path, exist_ok=True)
+    for name in TELEMETRY_COLUMNS:
+        np.save(os.path.join(store_path, f"{name}.npy"), columns[name])
+    with open(os.path.join(store_path, "dictionary.json"), "w", encoding="utf-8") as f:
+        json.dump(dictionary, f)
+
+def open_telemetry_store(store_path: str = TELEMETRY_STORE) -> dict:
+    """Memory-map the column store; pages are only read when a query touches them."""
+    with open(os.path.join(store_path, "dictionary.json"), "r", encoding="utf-8") as f:
+        dictionary = json.load(f)
+    columns = {
+        name: np.load(os.path.join(store_path, f"{name}.npy"), mmap_mode="r")
+        for name in TELEMETRY_COLUMNS
+    }
+    return index_telemetry_columns(columns, dictionary)
+
+def load_telemetry(path: str = None) -> dict:
+    """Load from the binary store when present, falling back to the JSON file."""
+    if path is None:
+        path = TELEMETRY_STORE if os.path.isdir(TELEMETRY_STORE) else "q-vercel-latency.json"
+    if os.path.isdir(path):
+        return open_telemetry_store(path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return build_telemetry_index(json.load(f))
+    except FileNotFoundError:
+        return {}
+
+# Loaded on first use rather than at import, to keep cold starts flat
+_telemetry_index = None
+_telemetry_lock = threading.Lock()
+
+def get_telemetry_index() -> dict:
+    global _telemetry_index
+    if _telemetry_index is None:
+        with _telemetry_lock:
+            if _telemetry_index is None:
+                _telemetry_index = load_telemetry()
+    return _telemetry_index
+
+# ---------------------------
+# Latency result cache
+# ---------------------------
+
+class LRUCache:
+    """Size-bounded LRU mapping with hit/miss counters and an optional TTL (seconds)."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+latency_cache = LRUCache(int(os.getenv("LATENCY_CACHE_SIZE", "256")))
+
+def reload_telemetry(path: str = None):
+    """Swap in freshly loaded telemetry and drop every cached result built on the old data."""
+    global _telemetry_index
+    index = load_telemetry(path)
+    with _telemetry_lock:
+        _telemetry_index = index
+    # Sketches were seeded from the old static data; rebuild them on the new data
+    telemetry_sketches.clear()
+    for region in streamed_sketches:
+        telemetry_sketches[region] = seeded_sketch(region)
+    latency_cache.clear()
+
+# ---------------------------
+# Streaming telemetry ingestion
+# ---------------------------
+
+class LatencySketch:
+    """
+    HDR-style latency histogram with log-spaced buckets plus running sums.
+
+    Memory is fixed by the bucket layout no matter how many rows are added,
+    and two sketches merge by adding their counts. Quantiles and breach counts
+    are accurate to the bucket width (~0.4% relative).
+    """
+
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def edges():
+        """Bucket upper bounds from 0.01 ms to 10 minutes."""
+        return np.geomspace(0.01, 600_000, 4096)
+
+    def __init__(self):
+        self.counts = np.zeros(len(self.edges()) + 1, dtype=np.int64)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.uptime_sum = 0.0
+        self.latency_min = float("inf")
+        self.latency_max = float("-inf")
+
+    def add(self, latency: np.ndarray, uptime: np.ndarray):
+        if len(latency) == 0:
+            return
+        buckets = np.searchsorted(self.edges(), latency, side="left")
+        self.counts += np.bincount(buckets, minlength=len(self.counts))
+        self.count += len(latency)
+        self.latency_sum += float(np.sum(latency))
+        self.uptime_sum += float(np.sum(uptime))
+        self.latency_min = min(self.latency_min, float(np.min(latency)))
+        self.latency_max = max(self.latency_max, float(np.max(latency)))
+
+    def merge(self, other: "LatencySketch"):
+        self.counts += other.counts
+        self.count += other.count
+        self.latency_sum += other.latency_sum
+        self.uptime_sum += other.uptime_sum
+        self.latency_min = min(self.latency_min, other.latency_min)
+        self.latency_max = max(self.latency_max, other.latency_max)
+
+    def _bucket_value(self, bucket: int) -> float:
+        if bucket == 0:
+            value = self.edges()[0]
+        elif bucket >= len(self.edges()):
+            value = self.latency_max
+        else:
+            value = np.sqrt(self.edges()[bucket - 1] * self.edges()[bucket])
+        return float(min(max(value, self.latency_min), self.latency_max))
+
+    def percentile(self, q: float) -> float:
+        # Same rank as numpy's default (linear) method: interpolate between the
+        # values at the floor and ceil ranks, each read from its bucket
+        rank = (self.count - 1) * q / 100.0
+        lower = math.floor(rank)
+        upper = min(lower + 1, self.count - 1)
+        buckets = np.searchsorted(np.cumsum(self.counts), [lower, upper], side="right")
+        low, high = self._bucket_value(int(buckets[0])), self._bucket_value(int(buckets[1]))
+        return low + (rank - lower) * (high - low)
+
+    def breaches(self, threshold: float) -> int:
+        bucket = int(np.searchsorted(self.edges(), threshold, side="left"))
+        above = int(self.counts[bucket + 1:].sum())
+        if bucket < len(self.edges()) and self.counts[bucket]:
+            # Assume values spread evenly (in log space) inside the straddling bucket
+            lower = self.edges()[bucket - 1] if bucket else 0.0
+            upper = self.edges()[bucket]
+            if lower > 0 and threshold > lower:
+                fraction = np.log(upper / threshold) / np.log(upper / lower)
+            else:
+                fraction = 1.0
+            above += int(round(self.counts[bucket] * fraction))
+        return above
+
+    def metrics(self, threshold: float, thresholds: tuple = (), buckets: tuple = ()) -> dict:
+        summary = {
+            "avg_latency": round(self.latency_sum / self.count, 2),
+            "p95_latency": round(self.percentile(95), 2),
+            "avg_uptime": round(self.uptime_sum / self.count, 3),
+            "breaches": self.breaches(threshold),
+        }
+        if thresholds:
+            summary["threshold_breaches"] = [self.breaches(t) for t in thresholds]
+        if buckets:
+            above = [self.breaches(edge) for edge in buckets]
+            summary["histogram"] = [lo - hi for lo, hi in zip(above, above[1:])]
+        return summary
+
+# Regions that have received streamed rows are answered from their sketch,
+# which is seeded with the region's static telemetry on first ingest. The
+# streamed rows alone are kept as well, so a reload can re-seed. Each region
+# costs two sketches (~64 KB), so the number of streamed regions is capped.
+INGEST_MAX_REGIONS = int(os.getenv("INGEST_MAX_REGIONS", "64"))
+telemetry_sketches = {}
+streamed_sketches = {}
+
+def seeded_sketch(region: str) -> LatencySketch:
+    """The region's static telemetry merged with everything streamed to it."""
+    sketch = LatencySketch()
+    static = get_telemetry_index().get(region)
+    if static is not None:
+        sketch.add(static.latency, static.uptime)
+    sketch.merge(streamed_sketches[region])
+    return sketch
+
+class TelemetryRecord(BaseModel):
+    region: str
+    service: str
+    latency_ms: float
+    uptime_pct: float
+    timestamp: int
+
+class IngestRequest(BaseModel):
+    records: List[TelemetryRecord]
+
+@app.post("/ingest")
+async def ingest_telemetry(request: IngestRequest):
+    batches = {}
+    for record in request.records:
+        batch = batches.setdefault(record.region, ([], []))
+        batch[0].append(record.latency_ms)
+        batch[1].append(record.uptime_pct)
+
+    new_regions = [region for region in batches if region not in streamed_sketches]
+    if len(streamed_sketches) + len(new_regions) > INGEST_MAX_REGIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {INGEST_MAX_REGIONS} regions can be streamed; "
+            f"{len(streamed_sketches)} already are and this batch adds {len(new_regions)}",
+        )
+
+    for region, (latencies, uptimes) in batches.items():
+        latencies, uptimes = np.asarray(latencies, dtype=np.float64), np.asarray(uptimes, dtype=np.float64)
+        streamed_sketches.setdefault(region, LatencySketch()).add(latencies, uptimes)
+        if region in telemetry_sketches:
+            telemetry_sketches[region].add(latencies, uptimes)
+        else:
+            telemetry_sketches[region] = seeded_sketch(region)
+    latency_cache.clear()
+
+    return {
+        "ingested": len(request.records),
+        "regions": {region: telemetry_sketches[region].count for region in batches},
+    }
+
+def finite_number(value) -> Optional[float]:
+    """value as a finite float, or None if it isn't one (booleans included)."""
+    if isinstance(value, bool):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def number_field(value, name: str) -> float:
+    number = finite_number(value)
+    if number is None:
+        raise HTTPException(status_code=400, detail=f"{name} must be a number")
+    return number
+
+def number_list_field(values, name: str) -> tuple:
+    numbers = [finite_number(value) for value in values] if isinstance(values, list) else [None]
+    if None in numbers:
+        raise HTTPException(status_code=400, detail=f"{name} must be a list of numbers")
+    return tuple(numbers)
 
 @app.post("/")
 async def latency_metrics(request: Request):
+    """
+    Per-region latency metrics. Optional body fields:
+      from / to  - inclusive timestamp bounds
+      group_by   - ["region"] (default) or ["region", "service"]
+      thresholds - extra thresholds; adds "threshold_breaches" in the same order
+      buckets    - ascending bucket edges; adds "histogram" counts for each (lo, hi] bucket
+    Sliced or per-service queries are served from the static columnar index;
+    streamed sketches only cover whole-range, per-region queries.
+    """
     body = await request.json()
     regions = body.get("regions", [])
-    threshold = body.get("threshold_ms", 180)
-
-    results = {}
-    for region in regions:
-        region_data = [r for r in telemetry if r["region"] == region]
-        if not region_data:
-            continue
-
-        latencies = [r["latency_ms"] for r in region_data]
-        uptimes = [r["uptime_pct"] for r in region_data]
-
-        avg_latency = float(np.mean(latencies))
-        p95_latency = float(np.percentile(latencies, 95))
-        avg_uptime = float(np.mean(uptimes))
-        breaches = sum(1 for l in latencies if l > threshold)
-
-        results[region] = {
-            "avg_latency": round(avg_latency, 2),
-            "p95_latency": round(p95_latency, 2),
-            "avg_uptime": round(avg_uptime, 3),
-            "breaches": breaches
-        }
+    if not isinstance(regions, list) or not all(isinstance(region, str) for region in regions):
+        raise HTTPException(status_code=400, detail="regions must be a list of strings")
+    threshold = number_field(body.get("threshold_ms", 180), "threshold_ms")
+    start = body.get("from")
+    end = body.get("to")
+    start = None if start is None else number_field(start, "from")
+    end = None if end is None else number_field(end, "to")
+    group_by = body.get("group_by", ["region"])
+    if group_by not in (["region"], ["region", "service"]):
+        raise HTTPException(status_code=400, detail='group_by must be ["region"] or ["region", "service"]')
+    by_service = "service" in group_by
+    whole_range = start is None and end is None
+    thresholds = number_list_field(body.get("thresholds", []), "thresholds")
+    buckets = number_list_field(body.get("buckets", []), "buckets")
+    if buckets and (len(buckets) < 2 or list(buckets) != sorted(buckets)):
+        raise HTTPException(status_code=400, detail="buckets must be at least two ascending edges")
+
+    key = (tuple(sorted(set(regions))), threshold, start, end, by_service, thresholds, buckets)
+    results = latency_cache.get(key)
+    if results is None:
+        telemetry_index = get_telemetry_index()
+        results = {}
+        for region in key[0]:
+            region_data = telemetry_index.get(region)
+            if by_service:
+                if region_data is None:
+                    continue
+                services = {}
+                for service, service_data in sorted(region_data.services.items()):
+                    stats = service_data.metrics(threshold, start, end, thresholds, buckets)
+                    if stats is not None:
+                        services[service] = stats
+                if services:
+                    results[region] = services
+                continue
+
+            if whole_range and region in telemetry_sketches:
+                region_data = telemetry_sketches[region]
+            if region_data is None:
+                continue
+            if isinstance(region_data, LatencySketch):
+                stats = region_data.metrics(threshold, thresholds, buckets)
+            else:
+                stats = region_data.metrics(threshold, start, end, thresholds, buckets)
+            if stats is not None:
+                results[region] = stats
+        latency_cache.put(key, results)
 
-    return {"regions": results}
+    return {"regions": {region: results[region] for region in regions if region in results}}
 
 # ---------------------------
 # Sentiment API (added)
@@ -80,48 +774,307 @@ class SentimentResponse(BaseModel):
 
 # Configure AIPipe base URL and token
 os.environ["OPENAI_BASE_URL"] = "https://aipipe.org/openai/v1/"
-openai_client = OpenAI(api_key=os.getenv("AIPIPE_TOKEN"))
+# One long-lived client keeps its keep-alive pool; the SDK retries 429/5xx with jittered backoff.
+# Built by the first /comment that misses the local tiers.
+openai_async_client = None
+_openai_client_lock = threading.Lock()
 
-@app.post("/comment", response_model=SentimentResponse)
-async def analyze_comment(request: CommentRequest):
-    try:
-        response_schema = {
-            "name": "sentiment_schema",
-            "schema": {
-                "type": "object",
-                "properties": {
-                    "sentiment": {
-                        "type": "string",
-                        "enum": ["positive", "negative", "neutral"]
-                    },
-                    "rating": {
-                        "type": "integer",
-                        "minimum": 1,
-                        "maximum": 5
-                    }
-                },
-                "required": ["sentiment", "rating"],
-                "additionalProperties": False
+def get_openai_client():
+    global openai_async_client
+    if openai_async_client is None:
+        with _openai_client_lock:
+            if openai_async_client is None:
+                openai_async_client = openai.AsyncOpenAI(
+                    api_key=os.getenv("AIPIPE_TOKEN"),
+                    timeout=AIPIPE_OPENAI_TIMEOUT,
+                    max_retries=OUTBOUND_MAX_RETRIES,
+                )
+    return openai_async_client
+
+SENTIMENT_MODEL = "gpt-4.1-mini"
+SENTIMENT_SCHEMA = {
+    "name": "sentiment_schema",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "sentiment": {
+                "type": "string",
+                "enum": ["positive", "negative", "neutral"]
+            },
+            "rating": {
+                "type": "integer",
+                "minimum": 1,
+                "maximum": 5
             }
-        }
+        },
+        "required": ["sentiment", "rating"],
+        "additionalProperties": False
+    }
+}
 
-        completion = openai_client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a sentiment analysis model."},
-                {"role": "user", "content": f"Analyze this comment:\n\n{request.comment}"}
-            ],
-            response_format={"type": "json_schema", "json_schema": response_schema},
-            temperature=0.1
-        )
+def sentiment_request(comment: str) -> dict:
+    """Keyword arguments for chat.completions.create."""
+    return {
+        "model": SENTIMENT_MODEL,
+        "messages": [
+            {"role": "system", "content": "You are a sentiment analysis model."},
+            {"role": "user", "content": f"Analyze this comment:\n\n{comment}"}
+        ],
+        "response_format": {"type": "json_schema", "json_schema": SENTIMENT_SCHEMA},
+        "temperature": 0.1,
+    }
+
+# --- Sentiment cache ---
+# Keyed on normalized text + model + schema, so changing either never serves stale shapes.
+_SENTIMENT_CACHE_SALT = f"{SENTIMENT_MODEL}\0{json.dumps(SENTIMENT_SCHEMA, sort_keys=True)}\0"
+
+def sentiment_cache_key(comment: str) -> str:
+    normalized = " ".join(unicodedata.normalize("NFKC", comment).casefold().split())
+    return hashlib.sha256((_SENTIMENT_CACHE_SALT + normalized).encode("utf-8")).hexdigest()
+
+class SentimentCache:
+    """
+    In-memory LRU/TTL tier in front of an optional SQLite tier. The SQLite file
+    survives restarts and can be shared by every worker on the host. SQLite
+    calls run on the blocking executor, and expired rows are purged every
+    purge_every writes.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, db_path: str = None, purge_every: int = 256):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize, ttl)
+        self.disk_hits = 0
+        self.purged = 0
+        self.purge_every = purge_every
+        self._writes = 0
+        self._db = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment_cache (key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS sentiment_cache_expires ON sentiment_cache (expires)")
+            self._db.commit()
+            self._purge()
+
+    def _purge(self):
+        with self._db_lock:
+            removed = self._db.execute("DELETE FROM sentiment_cache WHERE expires < ?", (time.time(),)).rowcount
+            self._db.commit()
+        self.purged += removed
+
+    def _db_get(self, key: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value FROM sentiment_cache WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _db_put(self, key: str, value: str):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sentiment_cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, value, time.time() + self.ttl),
+            )
+            self._db.commit()
+            self._writes += 1
+            purge = self._writes % self.purge_every == 0
+        if purge:
+            self._purge()
 
-        json_content = completion.choices[0].message.content
-        result = SentimentResponse.model_validate_json(json_content)
+    async def get(self, key: str) -> Optional[SentimentResponse]:
+        result = self.memory.get(key)
+        if result is not None or self._db is None:
+            return result
+        value = await run_blocking(self._db_get, key)
+        if value is None:
+            return None
+        self.disk_hits += 1
+        result = SentimentResponse.model_validate_json(value)
+        self.memory.put(key, result)
         return result
 
+    async def put(self, key: str, result: SentimentResponse):
+        self.memory.put(key, result)
+        if self._db is not None:
+            await run_blocking(self._db_put, key, result.model_dump_json())
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        saved = memory["hits"] + self.disk_hits
+        lookups = memory["hits"] + memory["misses"]
+        return {
+            "memory": memory,
+            "disk_enabled": self._db is not None,
+            "disk_hits": self.disk_hits,
+            "disk_purged": self.purged,
+            "saved_calls": saved,
+            "hit_ratio": round(saved / lookups, 4) if lookups else 0.0,
+        }
+
+sentiment_cache = SentimentCache(
+    maxsize=int(os.getenv("SENTIMENT_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SENTIMENT_CACHE_TTL", "86400")),
+    db_path=os.getenv("SENTIMENT_CACHE_DB"),
+)
+
+# --- Local sentiment tier ---
+# Word weights: 2 for strong, 1 for mild polarity. A negation flips the next
+# scored word and halves it, since "not bad" is weaker than "good".
+SENTIMENT_LEXICON = {
+    **dict.fromkeys(["love", "loved", "excellent", "amazing", "awesome", "fantastic", "perfect",
+                     "outstanding", "wonderful", "best", "brilliant", "superb", "great"], 2.0),
+    **dict.fromkeys(["good", "nice", "happy", "recommend", "helpful", "fast", "easy", "like",
+                     "liked", "works", "pleased", "satisfied", "fine", "solid"], 1.0),
+    **dict.fromkeys(["hate", "hated", "terrible", "awful", "horrible", "worst", "useless",
+                     "garbage", "scam", "broken", "disgusting", "pathetic", "refund"], -2.0),
+    **dict.fromkeys(["bad", "poor", "slow", "disappointed", "disappointing", "annoying", "buggy",
+                     "expensive", "problem", "issue", "wrong", "late", "difficult"], -1.0),
+}
+SENTIMENT_NEGATIONS = {"not", "no", "never", "dont", "don't", "isnt", "isn't", "wasnt", "wasn't",
+                       "cant", "can't", "didnt", "didn't", "hardly", "nothing"}
+LOCAL_SENTIMENT_THRESHOLD = float(os.getenv("LOCAL_SENTIMENT_THRESHOLD", "0.8"))
+
+class LexiconSentiment:
+    """Dependency-light first tier: a signed word-weight vector scored with NumPy."""
+
+    _token = re.compile(r"[a-z']+")
+
+    def __init__(self, lexicon: dict, negations: set):
+        self.lexicon = lexicon
+        self.vocabulary = {word: i for i, word in enumerate(lexicon)}
+        self.negations = negations
+
+    @functools.cached_property
+    def weights(self):
+        return np.array(list(self.lexicon.values()), dtype=np.float64)
+
+    def score(self, text: str) -> tuple:
+        """(sentiment, rating, confidence) for a comment."""
+        indices, signs, negate = [], [], False
+        for token in self._token.findall(text.lower()):
+            if token in self.negations:
+                negate = True
+                continue
+            index = self.vocabulary.get(token)
+            if index is not None:
+                indices.append(index)
+                signs.append(-0.5 if negate else 1.0)
+                negate = False
+
+        if not indices:
+            return "neutral", 3, 0.0
+        contributions = self.weights[indices] * np.asarray(signs)
+        total = float(contributions.sum())
+        magnitude = float(np.abs(contributions).sum())
+        # Mixed signals (agreement < 1) and weak evidence both lower the confidence
+        agreement = abs(total) / magnitude
+        confidence = agreement * (1.0 - float(np.exp(-abs(total))))
+        if total > 0:
+            return "positive", 5 if total >= 3 else 4, confidence
+        if total < 0:
+            return "negative", 1 if total <= -3 else 2, confidence
+        return "neutral", 3, 0.0
+
+local_sentiment = LexiconSentiment(SENTIMENT_LEXICON, SENTIMENT_NEGATIONS)
+
+class TierStats:
+    """Request counts and recent latencies for each sentiment tier."""
+
+    def __init__(self, tiers: tuple, window: int = 2048):
+        self.counts = dict.fromkeys(tiers, 0)
+        self.latencies = {tier: deque(maxlen=window) for tier in tiers}
+
+    def record(self, tier: str, seconds: float):
+        self.counts[tier] += 1
+        self.latencies[tier].append(seconds)
+
+    def stats(self) -> dict:
+        total = sum(self.counts.values())
+        report = {"requests": total}
+        for tier, count in self.counts.items():
+            samples = self.latencies[tier]
+            p50, p95 = np.percentile(samples, [50, 95]) * 1e3 if samples else (None, None)
+            report[tier] = {
+                "count": count,
+                "fraction": round(count / total, 4) if total else 0.0,
+                "p50_ms": round(float(p50), 3) if samples else None,
+                "p95_ms": round(float(p95), 3) if samples else None,
+            }
+        return report
+
+sentiment_tiers = TierStats(("cache", "local", "remote"))
+
+async def classify_comment(comment: str) -> SentimentResponse:
+    start = time.perf_counter()
+    key = sentiment_cache_key(comment)
+    cached = await sentiment_cache.get(key)
+    if cached is not None:
+        sentiment_tiers.record("cache", time.perf_counter() - start)
+        return cached
+
+    # Clearly polar comments never need the remote model
+    sentiment, rating, confidence = local_sentiment.score(comment)
+    if sentiment != "neutral" and confidence >= LOCAL_SENTIMENT_THRESHOLD:
+        sentiment_tiers.record("local", time.perf_counter() - start)
+        return SentimentResponse(sentiment=sentiment, rating=rating)
+
+    result = await comment_flight.do(key, lambda: remote_sentiment(comment, key))
+    sentiment_tiers.record("remote", time.perf_counter() - start)
+    return result
+
+comment_flight = SingleFlight()
+
+async def remote_sentiment(comment: str, key: str) -> SentimentResponse:
+    client = get_openai_client()
+    async with outbound.async_host_slot(str(client.base_url)):
+        completion = await client.chat.completions.create(**sentiment_request(comment))
+    result = SentimentResponse.model_validate_json(completion.choices[0].message.content)
+    await sentiment_cache.put(key, result)
+    return result
+
+@app.post("/comment", response_model=SentimentResponse)
+async def analyze_comment(request: CommentRequest):
+    try:
+        return await classify_comment(request.comment)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI analysis failed: {str(e)}")
 
+# --- Batch sentiment ---
+SENTIMENT_CONCURRENCY = int(os.getenv("SENTIMENT_CONCURRENCY", "16"))
+
+class BatchCommentRequest(BaseModel):
+    comments: List[str]
+    concurrency: Optional[int] = None  # defaults to SENTIMENT_CONCURRENCY, never above it
+
+class BatchSentimentItem(BaseModel):
+    result: Optional[SentimentResponse] = None
+    error: Optional[str] = None
+
+class BatchSentimentResponse(BaseModel):
+    results: List[BatchSentimentItem]
+
+@app.post("/comment/batch", response_model=BatchSentimentResponse)
+async def analyze_comments(request: BatchCommentRequest):
+    """
+    Classify many comments concurrently (bounded by a semaphore). Results come
+    back in input order; a failed item carries an error instead of failing the batch.
+    """
+    limit = min(request.concurrency or SENTIMENT_CONCURRENCY, SENTIMENT_CONCURRENCY)
+    semaphore = asyncio.Semaphore(max(limit, 1))
+
+    async def classify(comment: str) -> BatchSentimentItem:
+        async with semaphore:
+            try:
+                return BatchSentimentItem(result=await classify_comment(comment))
+            except Exception as e:
+                return BatchSentimentItem(error=f"AI analysis failed: {str(e)}")
+
+    results = await asyncio.gather(*(classify(comment) for comment in request.comments))
+    return BatchSentimentResponse(results=results)
+
 # ------------------------------------
 # Audio Processing - Timestamp Finder
 # ------------------------------------
@@ -132,76 +1085,600 @@ def normalize_url(url: str) -> str:
         return url.replace("youtube.com", "yewtu.be")
     return url
     
-def download_audio(url: str) -> str:
-    tmp_dir = tempfile.mkdtemp()
-    out_path = os.path.join(tmp_dir, "audio.%(ext)s")
+# Extraction profiles for yt-dlp:
+#   mp3    - transcode to 192 kbps stereo mp3 (the original behaviour)
+#   native - keep the source audio container, no re-encode (m4a preferred, as Gemini accepts it)
+#   speech - mono 16 kHz 32 kbps mp3; plenty for locating speech, a fraction of the upload
+AUDIO_PROFILES = {
+    "mp3": {
+        "format": "bestaudio/best",
+        "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "192"}],
+    },
+    "native": {
+        "format": "bestaudio[ext=m4a]/bestaudio[ext=mp3]/bestaudio/best",
+        "postprocessors": [],
+    },
+    "speech": {
+        "format": "worstaudio[abr>=32]/bestaudio/best",
+        "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "mp3", "preferredquality": "32"}],
+        "postprocessor_args": {"extractaudio": ["-ac", "1", "-ar", "16000"]},
+    },
+}
+AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "mp3")
+AUDIO_MIME_TYPES = {".mp3": "audio/mpeg", ".m4a": "audio/mp4", ".ogg": "audio/ogg", ".webm": "audio/webm"}
+
+def probe_audio(url: str, profile: str = AUDIO_PROFILE, timings: dict = None) -> dict:
+    """yt-dlp's info for url with the profile's format selected, without downloading anything."""
+    start = time.perf_counter()
+    with yt_dlp.YoutubeDL({"format": AUDIO_PROFILES[profile]["format"], "quiet": True}) as ydl:
+        info = ydl.extract_info(url, download=False)
+    if timings is not None:
+        timings["probe_s"] = round(time.perf_counter() - start, 3)
+    return info
+
+def download_audio(url: str, out_dir: str, profile: str = AUDIO_PROFILE, timings: dict = None,
+                   info: dict = None, limits: tuple = None) -> str:
+    """
+    Download (and, depending on the profile, transcode) the audio track into
+    out_dir; fills timings if given. info from probe_audio saves extracting
+    the video again. limits is (source, output) bytes: larger downloads are
+    refused and transcoded output is capped (see audio_scratch_limits).
+    """
+    out_path = os.path.join(out_dir, "audio.%(ext)s")
+    marks = {"start": time.perf_counter()}
+
+    def on_download(status):
+        if status["status"] == "finished":
+            marks["downloaded"] = time.perf_counter()
 
     ydl_opts = {
-        "format": "bestaudio/best",
+        **AUDIO_PROFILES[profile],
         "outtmpl": out_path,
         "quiet": True,
-        "postprocessors": [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-        }],
+        "progress_hooks": [on_download],
     }
+    output_limit = None
+    if limits is not None:
+        ydl_opts["max_filesize"], output_limit = limits
+        if output_limit:
+            args = dict(ydl_opts.get("postprocessor_args") or {})
+            args["extractaudio"] = [*args.get("extractaudio", []), "-fs", str(output_limit)]
+            ydl_opts["postprocessor_args"] = args
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+        if info is not None:
+            ydl.process_ie_result(info, download=True)
+        else:
+            ydl.download([url])
 
-    # find the mp3 file
-    for f in os.listdir(tmp_dir):
-        if f.endswith(".mp3"):
-            return os.path.join(tmp_dir, f)
+    done = time.perf_counter()
+    if timings is not None:
+        downloaded = marks.get("downloaded", done)
+        timings["download_s"] = round(downloaded - marks["start"], 3)
+        timings["transcode_s"] = round(done - downloaded, 3)
+
+    # find the extracted audio file (ignoring partial downloads)
+    for f in os.listdir(out_dir):
+        if not f.endswith((".part", ".ytdl")):
+            path = os.path.join(out_dir, f)
+            if output_limit and os.path.getsize(path) >= output_limit:
+                # ffmpeg stopped at -fs, so the audio is truncated
+                raise HTTPException(status_code=507, detail="Audio is larger than the scratch reservation")
+            return path
     raise FileNotFoundError("Audio file not found after download")
 
-# Initialize Gemini client (requires GOOGLE_API_KEY)
-gemini_client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+# --- Scratch space ---
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "ask-scratch"))
+# Run directories and saved transcripts; the audio cache keeps to its own AUDIO_CACHE_BYTES
+SCRATCH_BYTES = int(os.getenv("SCRATCH_BYTES", str(2 * 1024 ** 3)))
+SCRATCH_JOB_BYTES = int(os.getenv("SCRATCH_JOB_BYTES", str(512 * 1024 ** 2)))  # reserved when yt-dlp reports no size
+SCRATCH_SIZE_MARGIN = float(os.getenv("SCRATCH_SIZE_MARGIN", "1.1"))  # filesize_approx is only an estimate
+SCRATCH_RECHECK_INTERVAL = float(os.getenv("SCRATCH_RECHECK_INTERVAL", "5"))  # waiting runs re-check this often
+SCRATCH_ORPHAN_AGE = float(os.getenv("SCRATCH_ORPHAN_AGE", "3600"))  # older unowned dirs are leftovers
+SCRATCH_REAP_INTERVAL = float(os.getenv("SCRATCH_REAP_INTERVAL", "300"))
+
+def audio_scratch_limits(info: Optional[dict], profile: str = AUDIO_PROFILE) -> tuple:
+    """
+    (source, output) byte caps for downloading info's selected format with the
+    profile. The source comes from yt-dlp's filesize/filesize_approx, the
+    transcoded output from the duration and target bitrate (0 when the
+    profile keeps the source). Without those, SCRATCH_JOB_BYTES is split.
+    """
+    info = info or {}
+    transcode = next((p for p in AUDIO_PROFILES[profile]["postprocessors"] if p["key"] == "FFmpegExtractAudio"), None)
+    sizes = [f.get("filesize") or f.get("filesize_approx") for f in info.get("requested_formats") or [info]]
+    duration = info.get("duration")
+    if not all(sizes) or (transcode and not duration):
+        # The source and its transcoded copy coexist until the source is deleted
+        return (SCRATCH_JOB_BYTES // 2, SCRATCH_JOB_BYTES // 2) if transcode else (SCRATCH_JOB_BYTES, 0)
+    slack = 1024 ** 2  # container overhead on short clips
+    source = int(sum(sizes) * SCRATCH_SIZE_MARGIN) + slack
+    output = 0
+    if transcode:
+        kbps = int(transcode["preferredquality"])
+        output = int(duration * kbps * 125 * SCRATCH_SIZE_MARGIN) + slack
+    return source, output
+
+def directory_usage(path: str, skip: set = frozenset()) -> int:
+    """Total size of the files under path, leaving out the subdirectories in skip."""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [name for name in dirnames if os.path.join(dirpath, name) not in skip]
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass  # removed while we were walking
+    return total
+
+class ScratchSpace:
+    """
+    Owns every temporary directory the audio pipeline creates, under one root
+    with a total byte budget. Each run reserves its bytes up front and waits
+    until they fit, so concurrent runs can't overcommit the budget. Other
+    pipeline directories are tracked: saved transcripts count against the
+    budget, while the audio cache (which has its own) is only reported.
+    Run directories are removed when their work is done; anything left behind
+    (crashed workers, other processes) is reaped once it is older than
+    orphan_age, at startup and then on a timer.
+    """
+
+    def __init__(self, root: str, max_bytes: int, orphan_age: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.orphan_age = orphan_age
+        self.reaped = 0
+        self.refused = 0
+        self.waits = 0
+        self.waiting = 0
+        self._active = {}  # run directory -> reserved bytes
+        self._tracked = {}  # name -> (directory owned by another pipeline stage, counts against the budget)
+        self._lock = threading.Lock()
+        self._released = None  # asyncio.Condition, bound to the running loop
+        self._loop = None
+        os.makedirs(root, exist_ok=True)
+        self.reap()
+
+    def track(self, name: str, path: str, budgeted: bool = True):
+        """Report a pipeline directory that lives outside root, counting it against the budget if budgeted."""
+        self._tracked[name] = (path, budgeted)
+
+    def usage(self, budgeted_only: bool = False) -> dict:
+        """Bytes on disk per area; active runs are counted by their reservation instead."""
+        with self._lock:
+            active = set(self._active)
+        usage = {"scratch": directory_usage(self.root, active)}
+        for name, (path, budgeted) in self._tracked.items():
+            if budgeted or not budgeted_only:
+                usage[name] = directory_usage(path)
+        return usage
+
+    def reap(self) -> int:
+        """Remove unowned directories older than orphan_age; returns how many were removed."""
+        cutoff = time.time() - self.orphan_age
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            with self._lock:
+                if path in self._active:
+                    continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+        self.reaped += removed
+        return removed
+
+    def available(self) -> int:
+        used = sum(self.usage(budgeted_only=True).values())
+        with self._lock:
+            return max(self.max_bytes - used - sum(self._active.values()), 0)
+
+    def _admit(self, reserve: int) -> Optional[str]:
+        for attempt in range(2):
+            if attempt:
+                self.reap()
+            used = sum(self.usage(budgeted_only=True).values())
+            with self._lock:
+                if used + sum(self._active.values()) + reserve <= self.max_bytes:
+                    path = tempfile.mkdtemp(prefix="job-", dir=self.root)
+                    self._active[path] = reserve
+                    return path
+        return None
+
+    def _release(self, path: str):
+        shutil.rmtree(path, ignore_errors=True)
+        with self._lock:
+            self._active.pop(path, None)
+
+    def _condition(self) -> asyncio.Condition:
+        # Conditions are bound to the running loop, so create it lazily from inside it
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._released = asyncio.Condition()
+        return self._released
+
+    @asynccontextmanager
+    async def directory(self, reserve: int):
+        """
+        A fresh directory for one pipeline run with reserve bytes set aside,
+        always removed afterwards. Waits while the budget is taken by other
+        runs; only a reservation larger than the whole budget is refused.
+        Filesystem work runs off the event loop.
+        """
+        if reserve > self.max_bytes:
+            self.refused += 1
+            raise HTTPException(status_code=507, detail="Audio needs more scratch space than the whole budget")
+        released = self._condition()
+        async with released:
+            path = await run_blocking(self._admit, reserve)
+            if path is None:
+                self.waits += 1
+                self.waiting += 1
+                try:
+                    while path is None:
+                        # Finished runs notify; the timeout catches space freed any other way
+                        try:
+                            await asyncio.wait_for(released.wait(), SCRATCH_RECHECK_INTERVAL)
+                        except asyncio.TimeoutError:
+                            pass
+                        path = await run_blocking(self._admit, reserve)
+                finally:
+                    self.waiting -= 1
+        try:
+            yield path
+        finally:
+            await run_blocking(self._release, path)
+            async with released:
+                released.notify_all()
+
+    def stats(self) -> dict:
+        usage = self.usage()
+        with self._lock:
+            reserved = sum(self._active.values())
+            active = len(self._active)
+        return {
+            "root": self.root,
+            "bytes_used": usage,
+            "bytes_reserved": reserved,
+            "budget_bytes": self.max_bytes,
+            "active_dirs": active,
+            "reaped_dirs": self.reaped,
+            "waits": self.waits,
+            "waiting": self.waiting,
+            "refused": self.refused,
+        }
+
+scratch = ScratchSpace(SCRATCH_DIR, SCRATCH_BYTES, SCRATCH_ORPHAN_AGE)
+
+def reap_scratch_periodically():
+    while True:
+        time.sleep(SCRATCH_REAP_INTERVAL)
+        scratch.reap()
+
+if SCRATCH_REAP_INTERVAL > 0:
+    threading.Thread(target=reap_scratch_periodically, name="scratch-reaper", daemon=True).start()
+
+class StageTimings:
+    """Per-profile averages (and the latest run) of /ask pipeline stage timings and upload sizes."""
+
+    def __init__(self):
+        self._runs = {}  # profile -> {"totals": {...}, "counts": {...}, "last": {...}}
+        self._lock = threading.Lock()
+
+    def record(self, profile: str, stages: dict):
+        with self._lock:
+            entry = self._runs.setdefault(profile, {"totals": {}, "counts": {}, "last": {}})
+            for name, value in stages.items():
+                entry["totals"][name] = entry["totals"].get(name, 0) + value
+                entry["counts"][name] = entry["counts"].get(name, 0) + 1
+            entry["last"].update(stages)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                profile: {
+                    "samples": dict(entry["counts"]),
+                    "average": {
+                        name: round(total / entry["counts"][name], 3) for name, total in entry["totals"].items()
+                    },
+                    "last": entry["last"],
+                }
+                for profile, entry in self._runs.items()
+            }
+
+audio_stages = StageTimings()
+
+# Gemini client (requires GOOGLE_API_KEY), built by the first /ask that needs it
+gemini_client = None
+_gemini_client_lock = threading.Lock()
+
+def get_gemini_client():
+    global gemini_client
+    if gemini_client is None:
+        with _gemini_client_lock:
+            if gemini_client is None:
+                gemini_client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+    return gemini_client
+
+# --- Audio / Gemini file cache ---
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ask-audio-cache"))
+AUDIO_CACHE_BYTES = int(os.getenv("AUDIO_CACHE_BYTES", str(2 * 1024 ** 3)))
+# Gemini deletes uploaded files after 48h; stop reusing a reference a bit before that
+GEMINI_FILE_TTL = 47 * 3600
+GEMINI_FILE_MARGIN = 600
+GEMINI_ACTIVATION_TIMEOUT = float(os.getenv("GEMINI_ACTIVATION_TIMEOUT", "40"))
+
+def video_cache_key(url: str) -> str:
+    """Stable key for a video: YouTube links collapse to their video id."""
+    url = url.strip()
+    parts = urlsplit(url)
+    host = parts.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host in ("youtube.com", "yewtu.be") and parts.path == "/watch":
+        video_id = parse_qs(parts.query).get("v", [""])[0]
+        if video_id:
+            return f"youtube:{video_id}"
+    if host == "youtu.be" and parts.path.strip("/"):
+        return f"youtube:{parts.path.strip('/')}"
+    return f"{parts.scheme.lower()}://{host}{parts.path.rstrip('/')}?{parts.query}"
+
+class MediaCache:
+    """
+    Per-video cache for /ask: the downloaded audio file on local disk (LRU under
+    a byte budget) and the activated Gemini file reference (until it expires).
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.audio_hits = 0
+        self.audio_misses = 0
+        self.file_hits = 0
+        self.file_misses = 0
+        self._audio = OrderedDict()  # digest -> (path, size), least recent first
+        self._files = {}  # digest -> (uri, mime_type, expires_at)
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # Adopt audio left by a previous process, oldest first
+        existing = []
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue  # evicted by a sibling worker sharing the directory
+            existing.append((info.st_mtime, path, info.st_size))
+        for _, path, size in sorted(existing):
+            digest = os.path.splitext(os.path.basename(path))[0]
+            self._audio[digest] = (path, size)
+        self._evict()
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+    @property
+    def audio_bytes(self) -> int:
+        return sum(size for _, size in self._audio.values())
+
+    def _evict(self, keep: str = None):
+        while self.audio_bytes > self.max_bytes and len(self._audio) > (1 if keep else 0):
+            digest = next(iter(self._audio))
+            if digest == keep:
+                self._audio.move_to_end(digest)
+                continue
+            path, _ = self._audio.pop(digest)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def audio(self, key: str) -> Optional[str]:
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._audio.get(digest)
+            if entry is not None and os.path.exists(entry[0]):
+                self._audio.move_to_end(digest)
+                self.audio_hits += 1
+                return entry[0]
+            self._audio.pop(digest, None)
+            self.audio_misses += 1
+            return None
+
+    def add_audio(self, key: str, downloaded: str) -> str:
+        """Move a freshly downloaded file into the cache and return its new path."""
+        digest = self._digest(key)
+        path = os.path.join(self.root, digest + os.path.splitext(downloaded)[1])
+        shutil.move(downloaded, path)
+        with self._lock:
+            self._audio[digest] = (path, os.path.getsize(path))
+            self._audio.move_to_end(digest)
+            self._evict(keep=digest)
+        return path
+
+    def gemini_file(self, key: str) -> Optional[tuple]:
+        """(uri, mime_type) of a still-valid uploaded file for this video."""
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._files.get(digest)
+            if entry is not None and entry[2] - GEMINI_FILE_MARGIN > time.time():
+                self.file_hits += 1
+                return entry[0], entry[1]
+            self._files.pop(digest, None)
+            self.file_misses += 1
+            return None
+
+    def add_gemini_file(self, key: str, file, mime_type: str):
+        expiration = getattr(file, "expiration_time", None)
+        if isinstance(expiration, datetime):
+            expires_at = expiration.replace(tzinfo=expiration.tzinfo or timezone.utc).timestamp()
+        else:
+            expires_at = time.time() + GEMINI_FILE_TTL
+        with self._lock:
+            self._files[self._digest(key)] = (file.uri, mime_type, expires_at)
+
+    def forget_gemini_file(self, key: str):
+        with self._lock:
+            self._files.pop(self._digest(key), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "audio_files": len(self._audio),
+                "audio_bytes": self.audio_bytes,
+                "audio_budget_bytes": self.max_bytes,
+                "audio_hits": self.audio_hits,
+                "audio_misses": self.audio_misses,
+                "gemini_files": len(self._files),
+                "gemini_file_hits": self.file_hits,
+                "gemini_file_misses": self.file_misses,
+            }
+
+media_cache = MediaCache(AUDIO_CACHE_DIR, AUDIO_CACHE_BYTES)
+scratch.track("audio_cache", AUDIO_CACHE_DIR, budgeted=False)
+
+async def gemini_audio_file(video_url: str) -> tuple:
+    """
+    (uri, mime_type) of an ACTIVE Gemini file holding the video's audio,
+    reusing the cached upload and the cached local audio whenever possible.
+    """
+    # Audio from different profiles differs, so the profile is part of the key
+    key = f"{video_cache_key(video_url)}#{AUDIO_PROFILE}"
+    cached = media_cache.gemini_file(key)
+    if cached is not None:
+        return cached
+    # One download/upload per video, whatever topics or mode the callers asked about
+    return await audio_flight.do(key, lambda: upload_audio_file(video_url, key))
+
+audio_flight = SingleFlight()
+
+async def upload_audio_file(video_url: str, key: str) -> tuple:
+    # A flight for this key may have finished between the caller's cache check and now
+    cached = media_cache.gemini_file(key)
+    if cached is not None:
+        return cached
+
+    # Step 1: Download audio only (unless already on disk)
+    stages = {}
+    audio_file = media_cache.audio(key)
+    if audio_file is None:
+        url = normalize_url(video_url)
+        # Size the reservation from what yt-dlp says the download will be
+        info = await run_blocking(probe_audio, url, AUDIO_PROFILE, stages)
+        limits = audio_scratch_limits(info, AUDIO_PROFILE)
+        async with scratch.directory(sum(limits)) as work_dir:
+            downloaded = await run_blocking(download_audio, url, work_dir, AUDIO_PROFILE, stages, info, limits)
+            if not downloaded:
+                raise HTTPException(status_code=500, detail="Audio download failed")
+            audio_file = await run_blocking(media_cache.add_audio, key, downloaded)
+    extension = os.path.splitext(audio_file)[1].lower()
+    mime_type = AUDIO_MIME_TYPES.get(extension) or mimetypes.guess_type(audio_file)[0] or "audio/mpeg"
+
+    # Step 2: Upload to Gemini Files API
+    stages["upload_bytes"] = os.path.getsize(audio_file)
+    start = time.perf_counter()
+    file_ref = await run_blocking(get_gemini_client().files.upload, path=audio_file)
+    stages["upload_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+
+    # Step 3: Poll until ACTIVE, backing off exponentially within the overall budget
+    deadline = time.monotonic() + GEMINI_ACTIVATION_TIMEOUT
+    delay = 0.5
+    while True:
+        f = await run_blocking(get_gemini_client().files.get, name=file_ref.name)
+        if f.state == "ACTIVE":
+            break
+        if time.monotonic() + delay > deadline:
+            raise HTTPException(status_code=500, detail="File not activated in Gemini")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 8.0)
+    stages["activation_s"] = round(time.perf_counter() - start, 3)
+
+    media_cache.add_gemini_file(key, f, mime_type)
+    audio_stages.record(AUDIO_PROFILE, stages)
+    print(f"Audio pipeline ({AUDIO_PROFILE}):", stages)
+    return f.uri, mime_type
 
 class AskRequest(BaseModel):
     video_url: str
+    topic: Optional[str] = None
+    topics: Optional[List[str]] = None  # answered together with one Gemini call
+    mode: Literal["audio", "transcript"] = "audio"  # transcript: answer from a cached local index
+
+    @model_validator(mode="after")
+    def require_topic(self):
+        if not self.topic and not self.topics:
+            raise ValueError("Provide topic or topics")
+        return self
+
+    def topic_list(self) -> List[str]:
+        topics = ([self.topic] if self.topic else []) + list(self.topics or [])
+        return list(dict.fromkeys(topics))
+
+class TopicTimestamp(BaseModel):
     topic: str
+    timestamp: str  # HH:MM:SS
 
 class AskResponse(BaseModel):
     timestamp: str  # HH:MM:SS
     video_url: str
     topic: str
+    answers: Optional[List[TopicTimestamp]] = None  # every topic, when several were asked
+
+TIMESTAMP_PATTERN = "^[0-9]{2}:[0-9]{2}:[0-9]{2}$"
 
-@app.post("/ask", response_model=AskResponse)
+ask_flight = SingleFlight()
+
+async def answer_ask(request: AskRequest) -> AskResponse:
+    topics = request.topic_list()
+    # Identical video + topics requests arriving together share one pipeline run
+    key = (video_cache_key(request.video_url), tuple(t.strip().casefold() for t in topics), request.mode)
+    timestamps = await ask_flight.do(key, lambda: find_topic_timestamps(request.video_url, topics, request.mode))
+    response = AskResponse(timestamp=timestamps[0], video_url=request.video_url, topic=topics[0])
+    if len(topics) > 1:
+        response.answers = [TopicTimestamp(topic=t, timestamp=ts) for t, ts in zip(topics, timestamps)]
+    return response
+
+@app.post("/ask", response_model=AskResponse, response_model_exclude_none=True)
 async def ask(request: AskRequest):
-    # Step 1: Download audio only
-    tmp_dir = tempfile.mkdtemp()
-    out_path = os.path.join(tmp_dir, "audio.%(ext)s")
+    return await answer_ask(request)
 
+async def find_topic_timestamps(video_url: str, topics: List[str], mode: str) -> List[str]:
     try:
-        cmd = [
-            "yt-dlp",
-            "-x",
-            "--audio-format", "mp3",
-            "-o", out_path,
-            request.video_url
-        ]
-        video_url = normalize_url(request.video_url)
-        audio_file = download_audio(video_url)
-        if not audio_file:
-            raise HTTPException(status_code=500, detail="Audio download failed")
-
-        # Step 2: Upload to Gemini Files API
-        file_ref = gemini_client.files.upload(path=audio_file)
-
-        # Step 3: Poll until ACTIVE
-        for _ in range(20):
-            f = client.files.get(name=file_ref.name)
-            if f.state == "ACTIVE":
-                break
-            time.sleep(2)
-        else:
-            raise HTTPException(status_code=500, detail="File not activated in Gemini")
+        if mode == "transcript":
+            index = await transcript_index(video_url)
+            timestamps = [index.lookup(topic) for topic in topics]
+            missing = [topic for topic, ts in zip(topics, timestamps) if ts is None]
+            transcript_stats["local_answers"] += len(topics) - len(missing)
+            if missing:
+                # Only topics the transcript cannot place go back to the model
+                transcript_stats["llm_fallbacks"] += len(missing)
+                answers = iter(await ask_gemini_timestamps(video_url, missing))
+                timestamps = [ts if ts is not None else next(answers) for ts in timestamps]
+            return timestamps
+
+        return await ask_gemini_timestamps(video_url, topics)
+
+    except HTTPException:
+        raise
+    except subprocess.CalledProcessError as e:
+        raise HTTPException(status_code=500, detail=f"yt-dlp failed: {e.stderr.decode()}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Step 4: Ask Gemini with structured output
+async def generate_from_audio(video_url: str, prompt: str, response_schema: dict) -> dict:
+    """One structured Gemini call over the video's (cached) audio upload."""
+    # Steps 1-3: Download, upload and activate (skipped when cached for this video)
+    file_uri, mime_type = await gemini_audio_file(video_url)
 
-        result = client.models.generate_content(
+    # Step 4: Ask Gemini with structured output
+    start = time.perf_counter()
+    try:
+        result = await run_blocking(
+            get_gemini_client().models.generate_content,
             model="gemini-2.5-flash",
             contents=[
                 {
@@ -209,79 +1686,581 @@ async def ask(request: AskRequest):
                     "parts": [
                         {
                             "file_data": {
-                                "file_uri": f.uri,
-                                "mime_type": "audio/mpeg"
+                                "file_uri": file_uri,
+                                "mime_type": mime_type
                             }
                         },
-                        {
-                            "text": (
-                                f"Find when the topic '{request.topic}' "
-                                f"is first mentioned in this audio. "
-                                f"Respond with JSON using the schema below."
-                            )
-                        },
+                        {"text": prompt},
                     ],
                 }
             ],
             config={
                 "response_mime_type": "application/json",
-                "response_schema": {
-                    "type": "object",
-                    "properties": {
-                        "timestamp": {
-                            "type": "string",
-                            "pattern": "^[0-9]{2}:[0-9]{2}:[0-9]{2}$"
-                        }
-                    },
-                    "required": ["timestamp"],
-                    "additionalProperties": False,
-                },
+                "response_schema": response_schema,
             },
         )
+    except Exception:
+        # The cached upload may have been deleted early; re-upload on the next request
+        media_cache.forget_gemini_file(f"{video_cache_key(video_url)}#{AUDIO_PROFILE}")
+        raise
+    audio_stages.record(AUDIO_PROFILE, {"generate_s": round(time.perf_counter() - start, 3)})
 
-        try:
-            data = json.loads(result.text)
-            ts = data.get("timestamp")
-        except Exception:
-            raise HTTPException(status_code=500, detail="Invalid JSON returned by Gemini")
-        return AskResponse(timestamp=ts, video_url=request.video_url, topic=request.topic)
+    try:
+        return json.loads(result.text)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Invalid JSON returned by Gemini")
 
-    except subprocess.CalledProcessError as e:
-        raise HTTPException(status_code=500, detail=f"yt-dlp failed: {e.stderr.decode()}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Step 6: Clean up
+async def ask_gemini_timestamps(video_url: str, topics: List[str]) -> List[str]:
+    """First-mention timestamps for all topics from a single Gemini call."""
+    listed = "\n".join(f"{i}. '{topic}'" for i, topic in enumerate(topics, 1))
+    data = await generate_from_audio(
+        video_url,
+        (
+            f"For each topic below, find when it is first mentioned in this audio:\n{listed}\n"
+            f"Respond with JSON using the schema below, one timestamp per topic, in the same order."
+        ),
+        {
+            "type": "object",
+            "properties": {
+                "timestamps": {
+                    "type": "array",
+                    "items": {"type": "string", "pattern": TIMESTAMP_PATTERN},
+                }
+            },
+            "required": ["timestamps"],
+        },
+    )
+    timestamps = data.get("timestamps") if isinstance(data, dict) else None
+    if not isinstance(timestamps, list) or len(timestamps) != len(topics):
+        raise HTTPException(status_code=500, detail="Gemini did not return one timestamp per topic")
+    return timestamps
+
+# --- Transcript index ---
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", os.path.join(tempfile.gettempdir(), "ask-transcripts"))
+scratch.track("transcripts", TRANSCRIPT_DIR)
+TRANSCRIPT_MIN_COVERAGE = float(os.getenv("TRANSCRIPT_MIN_COVERAGE", "0.5"))
+TRANSCRIPT_STOPWORDS = {"a", "an", "the", "of", "and", "or", "to", "in", "on", "for", "is", "it", "what", "how"}
+
+class TranscriptIndex:
+    """Timestamped transcript segments plus an inverted index from token to segment ids."""
+
+    _token = re.compile(r"[a-z0-9']+")
+
+    def __init__(self, segments: List[dict]):
+        self.segments = [(s["start"], s["text"]) for s in segments]
+        self.postings = {}
+        for segment_id, (_, text) in enumerate(self.segments):
+            for token in set(self.tokenize(text)):
+                self.postings.setdefault(token, []).append(segment_id)
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls._token.findall(text.lower())
+
+    def lookup(self, topic: str) -> Optional[str]:
+        """Earliest segment covering the most topic tokens, or None if coverage is too low."""
+        tokens = set(self.tokenize(topic))
+        tokens = (tokens - TRANSCRIPT_STOPWORDS) or tokens
+        if not tokens:
+            return None
+        hits = Counter(segment_id for token in tokens for segment_id in self.postings.get(token, ()))
+        if not hits:
+            return None
+        best = max(hits.values())
+        if best / len(tokens) < TRANSCRIPT_MIN_COVERAGE:
+            return None
+        return self.segments[min(s for s, count in hits.items() if count == best)][0]
+
+transcript_indexes = LRUCache(int(os.getenv("TRANSCRIPT_CACHE_SIZE", "64")))
+transcript_flight = SingleFlight()
+transcript_stats = {"built": 0, "not_saved": 0, "local_answers": 0, "llm_fallbacks": 0}
+
+async def transcript_index(video_url: str) -> TranscriptIndex:
+    """The video's transcript index: memory, then disk, then one Gemini transcription."""
+    key = video_cache_key(video_url)
+    index = transcript_indexes.get(key)
+    if index is None:
+        index = await transcript_flight.do(key, lambda: load_or_build_transcript(video_url, key))
+        transcript_indexes.put(key, index)
+    return index
+
+def read_transcript(path: str) -> Optional[list]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_transcript(path: str, segments: list) -> bool:
+    """Persist segments unless that would overrun the scratch budget (memory still serves them)."""
+    payload = json.dumps(segments).encode("utf-8")
+    if scratch.available() < len(payload):
+        return False
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(payload)
+    return True
+
+async def load_or_build_transcript(video_url: str, key: str) -> TranscriptIndex:
+    path = os.path.join(TRANSCRIPT_DIR, hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + ".json")
+    segments = await run_blocking(read_transcript, path)
+    if segments is not None:
+        return TranscriptIndex(segments)
+
+    data = await generate_from_audio(
+        video_url,
+        (
+            "Transcribe this audio as consecutive segments of a sentence or two. "
+            "Give each segment's start time. Respond with JSON using the schema below."
+        ),
+        {
+            "type": "object",
+            "properties": {
+                "segments": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "start": {"type": "string", "pattern": TIMESTAMP_PATTERN},
+                            "text": {"type": "string"},
+                        },
+                        "required": ["start", "text"],
+                    },
+                }
+            },
+            "required": ["segments"],
+        },
+    )
+    segments = data.get("segments") if isinstance(data, dict) else None
+    if not isinstance(segments, list):
+        raise HTTPException(status_code=500, detail="Gemini returned no transcript segments")
+    segments = sorted(segments, key=lambda s: s["start"])  # HH:MM:SS sorts lexically
+
+    if not await run_blocking(save_transcript, path, segments):
+        transcript_stats["not_saved"] += 1
+    transcript_stats["built"] += 1
+    return TranscriptIndex(segments)
+
+# --- Asynchronous /ask jobs ---
+ASK_WORKERS = int(os.getenv("ASK_WORKERS", "4"))
+ASK_QUEUE_LIMIT = int(os.getenv("ASK_QUEUE_LIMIT", "100"))
+ASK_JOB_TTL = float(os.getenv("ASK_JOB_TTL", "3600"))  # how long finished jobs stay queryable
+
+class AskJob(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    result: Optional[AskResponse] = None
+    error: Optional[str] = None
+
+class AskJobQueue:
+    """
+    Bounded queue of /ask pipelines drained by a fixed pool of worker tasks,
+    so HTTP requests return immediately instead of holding a worker for the
+    whole download -> upload -> poll -> generate cycle.
+    """
+
+    def __init__(self, workers: int, limit: int, ttl: float):
+        self.workers = workers
+        self.limit = limit
+        self.ttl = ttl
+        self.jobs = OrderedDict()  # job_id -> (AskJob, finished_at)
+        self._queue = None
+        self._tasks = []
+        self._loop = None
+
+    def _ensure_workers(self):
+        # Workers are bound to the running loop, so start them lazily from inside it
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.limit)
+            self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.ttl
+        for job_id, (job, finished_at) in list(self.jobs.items()):
+            if finished_at is not None and finished_at < cutoff:
+                del self.jobs[job_id]
+
+    def submit(self, request: AskRequest) -> AskJob:
+        self._ensure_workers()
+        self._prune()
+        job = AskJob(job_id=uuid.uuid4().hex, status="queued")
         try:
-            for f in os.listdir(tmp_dir):
-                os.remove(os.path.join(tmp_dir, f))
-            os.rmdir(tmp_dir)
-        except Exception:
-            pass
+            self._queue.put_nowait((job, request))
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Ask job queue is full", headers={"Retry-After": "5"})
+        self.jobs[job.job_id] = (job, None)
+        return job
+
+    def get(self, job_id: str) -> Optional[AskJob]:
+        entry = self.jobs.get(job_id)
+        return entry[0] if entry else None
+
+    async def _work(self):
+        while True:
+            job, request = await self._queue.get()
+            job.status = "running"
+            try:
+                job.result = await answer_ask(request)
+                job.status = "done"
+            except HTTPException as e:
+                job.status, job.error = "failed", str(e.detail)
+            except asyncio.CancelledError:
+                job.status, job.error = "failed", "cancelled"
+                # Only a cancellation aimed at this worker stops it; one surfacing
+                # from a shared call it joined just fails the job
+                if asyncio.current_task().cancelling():
+                    raise
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+            finally:
+                self.jobs[job.job_id] = (job, time.monotonic())
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        statuses = [job.status for job, _ in self.jobs.values()]
+        return {
+            "workers": self.workers,
+            "queue_limit": self.limit,
+            "queued": statuses.count("queued"),
+            "running": statuses.count("running"),
+            "done": statuses.count("done"),
+            "failed": statuses.count("failed"),
+        }
+
+ask_jobs = AskJobQueue(ASK_WORKERS, ASK_QUEUE_LIMIT, ASK_JOB_TTL)
+
+@app.post("/ask/jobs", response_model=AskJob, status_code=202)
+async def submit_ask_job(request: AskRequest):
+    return ask_jobs.submit(request)
+
+@app.get("/ask/jobs/{job_id}", response_model=AskJob)
+async def ask_job_status(job_id: str):
+    job = ask_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job
 
 # -----------------
 # Code Interpreter
 # -----------------
 
 # --- Tool Function: Execute Python Code ---
-def execute_python_code(code: str) -> dict:
+def snippet_error_lines(code: str, exc: BaseException) -> List[int]:
+    """
+    Line numbers of the snippet that raised exc, read from the traceback:
+    the innermost "<string>" frame, or SyntaxError.lineno when the snippet
+    itself failed to compile. Returns [] when that can't be decided locally.
+    """
+    frames = [frame for frame in traceback.extract_tb(exc.__traceback__) if frame.filename == "<string>"]
+    if isinstance(exc, SyntaxError) and not frames:
+        line = exc.lineno
+    elif frames:
+        line = frames[-1].lineno
+    else:
+        return []
+    # eval()/exec() inside the snippet also report "<string>"; their lines may not be ours
+    if not line or line > code.count("\n") + 1:
+        return []
+    return [line]
+
+# Each worker keeps its own compiled snippets, so resubmitting the same code skips compile()
+CODE_COMPILE_CACHE_SIZE = int(os.environ.get("CODE_COMPILE_CACHE_SIZE", "256"))
+compiled_snippets = LRUCache(CODE_COMPILE_CACHE_SIZE)
+
+def compile_snippet(code: str):
+    """Returns (code object, whether it came from the cache)."""
+    key = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    compiled = compiled_snippets.get(key)
+    if compiled is not None:
+        return compiled, True
+    compiled = compile(code, "<string>", "exec")
+    compiled_snippets.put(key, compiled)
+    return compiled, False
+
+def top_functions(profiler, limit: int) -> List[dict]:
+    """The limit functions with the most cumulative time in a cProfile run."""
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+    return [
+        {
+            "function": pstats.func_std_string(func),
+            "calls": calls,
+            "total_ms": round(total * 1e3, 3),
+            "cumulative_ms": round(cumulative * 1e3, 3),
+        }
+        for func, (_, calls, total, cumulative, _) in ranked[:limit]
+    ]
+
+def locate_error(code: str, exc: BaseException) -> dict:
+    """snippet_error_lines plus how long the worker spent on it, for the error-line tier stats."""
+    start = time.perf_counter()
+    error_lines = snippet_error_lines(code, exc)
+    return {"error_lines": error_lines, "analysis_seconds": time.perf_counter() - start}
+
+# Runs inside a code worker process (see CodeExecutionPool below), so swapping
+# sys.stdout only affects that worker's own snippet. With profile set, the
+# result also carries wall/CPU time, the tracemalloc peak and, if profile_top
+# is positive, that many of the snippet's heaviest functions.
+def execute_python_code(code: str, profile: bool = False, profile_top: int = 0) -> dict:
     old_stdout = sys.stdout
     sys.stdout = StringIO()
+    profiler = cProfile.Profile() if profile and profile_top else None
+    compile_cached = False
+    if profile:
+        tracemalloc.start()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
 
     try:
-        exec(code)
+        compiled, compile_cached = compile_snippet(code)
+        namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+        if profiler:
+            profiler.runcall(exec, compiled, namespace)
+        else:
+            exec(compiled, namespace)
         output = sys.stdout.getvalue()
-        return {"success": True, "output": output}
-    except Exception:
+        result = {"success": True, "output": output}
+    except Exception as exc:
         output = traceback.format_exc()
-        return {"success": False, "output": output}
+        result = {"success": False, "output": output, **locate_error(code, exc)}
     finally:
         sys.stdout = old_stdout
+        if profile:
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    result["compile_cached"] = compile_cached
+    if profile:
+        result["profile"] = {
+            "wall_ms": round(wall * 1e3, 3),
+            "cpu_ms": round(cpu * 1e3, 3),
+            "peak_memory_bytes": peak,
+            "compile_cached": compile_cached,
+            "top_functions": top_functions(profiler, profile_top) if profiler else None,
+        }
+    return result
+
+# --- Code worker processes ---
+CODE_WORKERS = int(os.environ.get("CODE_WORKERS", "4"))
+CODE_QUEUE_LIMIT = int(os.environ.get("CODE_QUEUE_LIMIT", "32"))    # waiting snippets beyond busy workers
+CODE_MAX_RUNS = int(os.environ.get("CODE_MAX_RUNS", "100"))         # recycle a worker after this many snippets
+CODE_WALL_TIMEOUT = float(os.environ.get("CODE_WALL_TIMEOUT", "10"))
+CODE_CPU_TIMEOUT = int(os.environ.get("CODE_CPU_TIMEOUT", "5"))
+CODE_MEMORY_MB = int(os.environ.get("CODE_MEMORY_MB", "512"))       # on top of the worker's baseline
+
+class CPUTimeExceeded(BaseException):
+    """BaseException, so a snippet's own `except Exception:` can't swallow the CPU limit."""
+
+def _cpu_time_exceeded(signum, frame):
+    raise CPUTimeExceeded(f"snippet exceeded the {CODE_CPU_TIMEOUT}s CPU time limit")
+
+def code_worker_main(conn, cpu_seconds: int, memory_bytes: int, inherited_fds=()):
+    """Worker loop: receive a snippet, run it under CPU/memory limits, send the result back."""
+    import resource
+
+    # Lead a process group of our own, so stopping the worker kills anything a snippet started too
+    os.setsid()
+    # Pipe ends copied in by fork that belong to the server; holding them would hide EOFs
+    for fd in inherited_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGXCPU, _cpu_time_exceeded)
+    if memory_bytes:
+        # The worker is forked from the server, so limit growth beyond what it already maps
+        try:
+            with open("/proc/self/statm") as f:
+                baseline = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            baseline = 0
+        resource.setrlimit(resource.RLIMIT_AS, (baseline + memory_bytes, resource.RLIM_INFINITY))
+    # No new processes or threads from snippets (not enforced when running as root).
+    # Native libraries would otherwise try to start thread pools and fail noisily.
+    for name in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[name] = "1"
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+    while True:
+        try:
+            code, profile, profile_top = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        # RLIMIT_CPU counts the whole process lifetime, so move the soft limit per snippet
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = int(usage.ru_utime + usage.ru_stime)
+        resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_seconds + 1, resource.RLIM_INFINITY))
+        try:
+            result = execute_python_code(code, profile, profile_top)
+        except (CPUTimeExceeded, SystemExit) as exc:
+            # sys.exit() or the CPU limit: BaseExceptions that execute_python_code lets through
+            result = {"success": False, "output": traceback.format_exc(), **locate_error(code, exc)}
+        finally:
+            resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+        conn.send(result)
+
+class CodeWorker:
+    """One pre-started worker process and the pipe used to talk to it."""
+
+    def __init__(self, ctx, cpu_seconds: int, memory_bytes: int, siblings=()):
+        self.conn, child_conn = ctx.Pipe()
+        inherited = [sibling.conn.fileno() for sibling in siblings] + [self.conn.fileno()]
+        self.process = ctx.Process(
+            target=code_worker_main, args=(child_conn, cpu_seconds, memory_bytes, inherited), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+        self.stopped = False
+
+    def run(self, code: str, timeout: float, profile: bool = False, profile_top: int = 0) -> dict:
+        self.runs += 1
+        self.conn.send((code, profile, profile_top))
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()  # EOFError if the worker died mid-snippet
+
+    def stop(self):
+        self.stopped = True
+        try:
+            # The worker leads its own process group, so this takes its descendants too
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()  # still starting up, before setsid()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+class CodeExecutionPool:
+    """
+    Runs snippets in a pool of isolated worker processes. Each worker has its
+    own stdout and resource limits; a snippet that overruns the wall-clock
+    limit gets its worker killed and replaced, workers are recycled after
+    max_runs snippets or a crash, and callers beyond the queue limit get a 503
+    instead of piling up behind slow code.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, max_runs: int,
+                 wall_timeout: float, cpu_timeout: int, memory_bytes: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.max_runs = max_runs
+        self.wall_timeout = wall_timeout
+        self.cpu_timeout = cpu_timeout
+        self.memory_bytes = memory_bytes
+        self.runs = 0
+        self.timeouts = 0
+        self.crashes = 0
+        self.recycled = 0
+        self.rejected = 0
+        self.compile_hits = 0
+        self._pending = 0
+        self._idle = queue.SimpleQueue()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._live = set()
+        self._spawn_lock = threading.Lock()
+
+    def _spawn(self) -> CodeWorker:
+        # Forking keeps workers warm: the interpreter and common imports are already loaded
+        ctx = multiprocessing.get_context("fork" if sys.platform != "win32" else "spawn")
+        # Forks are serialized so no child inherits another's not-yet-closed child end,
+        # which would keep that pipe open after its worker dies and turn a crash into a timeout
+        with self._spawn_lock:
+            worker = CodeWorker(ctx, self.cpu_timeout, self.memory_bytes, list(self._live))
+            self._live.add(worker)
+        return worker
+
+    def _retire(self, worker: CodeWorker):
+        with self._spawn_lock:
+            self._live.discard(worker)
+        worker.stop()
+
+    def stop(self):
+        """Kill every worker (and whatever it started); called at app shutdown."""
+        with self._spawn_lock:
+            workers, self._live = self._live, set()
+        for worker in workers:
+            worker.stop()
+
+    def start(self):
+        """Fork the workers; called at app startup so the first snippets find them warm."""
+        with self._lock:
+            if self._executor is None:
+                for _ in range(self.workers):
+                    self._idle.put(self._spawn())
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="code")
+
+    def _run(self, code: str, profile: bool, profile_top: int) -> dict:
+        worker = self._idle.get()
+        try:
+            try:
+                result = worker.run(code, self.wall_timeout, profile, profile_top)
+            except TimeoutError:
+                self.timeouts += 1
+                self._retire(worker)
+                result = {"success": False, "output": f"TimeoutError: snippet exceeded the {self.wall_timeout:g}s wall-clock limit\n"}
+            except (EOFError, OSError):
+                self.crashes += 1
+                self._retire(worker)
+                result = {"success": False, "output": f"RuntimeError: code worker crashed (exit code {worker.process.exitcode})\n"}
+            if not worker.stopped and worker.runs >= self.max_runs:
+                self.recycled += 1
+                self._retire(worker)
+            if worker.stopped:
+                # Forked outside the except blocks so the new worker doesn't inherit the exception context
+                worker = self._spawn()
+        finally:
+            self._idle.put(worker)
+        self.runs += 1
+        self.compile_hits += bool(result.get("compile_cached"))
+        return result
+
+    async def run(self, code: str, profile: bool = False, profile_top: int = 0) -> dict:
+        if self._executor is None:
+            # Only reached when the server skipped startup events; keep the forks off the loop
+            await run_blocking(self.start)
+        with self._lock:
+            if self._pending >= self.workers + self.queue_limit:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Code interpreter is busy", headers={"Retry-After": "1"})
+            self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._run, code, profile, profile_top)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "runs": self.runs,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+            "recycled": self.recycled,
+            "rejected": self.rejected,
+            "compile_cache_hits": self.compile_hits,
+        }
+
+code_pool = CodeExecutionPool(
+    CODE_WORKERS, CODE_QUEUE_LIMIT, CODE_MAX_RUNS,
+    CODE_WALL_TIMEOUT, CODE_CPU_TIMEOUT, CODE_MEMORY_MB * 1024 * 1024,
+)
 
 # --- AI Error Analysis using AIPipe ---
 class ErrorAnalysis(BaseModel):
     error_lines: List[int]
 
+AIPIPE_GEMINI_URL = "https://aipipe.org/geminiv1beta/models/gemini-2.5-flash-lite:generateContent"
+
 def analyze_error_with_ai(code: str, traceback_str: str) -> List[int]:
     """
     Use Gemini via AIPipe to identify error line numbers.
@@ -290,7 +2269,7 @@ def analyze_error_with_ai(code: str, traceback_str: str) -> List[int]:
     if not aipipe_token:
         raise ValueError("AIPIPE_TOKEN environment variable not set")
 
-    url = "https://aipipe.org/geminiv1beta/models/gemini-2.5-flash-lite:generateContent"
+    url = AIPIPE_GEMINI_URL
 
     # Prompt for AI
     prompt = f"""
@@ -316,7 +2295,7 @@ Return only JSON like:
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url, headers=headers, json=payload)
+    response = outbound.post(url, headers=headers, json=payload, timeout=AIPIPE_GEMINI_TIMEOUT)
     response.raise_for_status()
     data = response.json()
     print("AI response:", data)
@@ -338,25 +2317,57 @@ Return only JSON like:
         return []
 
 # --- Request/Response Models ---
+CODE_PROFILE_TOP_MAX = 50
+
 class CodeRequest(BaseModel):
     code: str
+    profile: bool = False  # report timings and peak memory in CodeResponse.profile
+    profile_top: int = 0   # with profile, also list this many cProfile functions
+
+class ProfiledFunction(BaseModel):
+    function: str
+    calls: int
+    total_ms: float
+    cumulative_ms: float
+
+class ExecutionProfile(BaseModel):
+    wall_ms: float
+    cpu_ms: float
+    peak_memory_bytes: int  # tracemalloc peak, Python allocations only
+    compile_cached: bool
+    top_functions: Optional[List[ProfiledFunction]] = None
 
 class CodeResponse(BaseModel):
     error: List[int]
     result: str
+    profile: Optional[ExecutionProfile] = None
+
+# Error lines come from the worker's traceback walk; Gemini only sees what that couldn't place.
+# Both tiers record the time spent finding the lines, not the snippet's run time.
+error_line_tiers = TierStats(("local", "ai"))
 
 # --- Endpoint ---
-@app.post("/code-interpreter", response_model=CodeResponse)
+@app.post("/code-interpreter", response_model=CodeResponse, response_model_exclude_none=True)
 async def code_interpreter(request: CodeRequest):
-    execution_result = execute_python_code(request.code)
+    profile_top = max(0, min(request.profile_top, CODE_PROFILE_TOP_MAX))
+    execution_result = await code_pool.run(request.code, request.profile, profile_top)
     print("Execution result:", execution_result)
+    profile = execution_result.get("profile")
     if execution_result["success"]:
-        return {"error": [], "result": execution_result["output"]}
+        return {"error": [], "result": execution_result["output"], "profile": profile}
+
+    error_lines = execution_result.get("error_lines")
+    if error_lines:
+        # Timed in the worker, where the traceback walk actually happens
+        error_line_tiers.record("local", execution_result["analysis_seconds"])
+        return {"error": error_lines, "result": execution_result["output"], "profile": profile}
 
     print("Executing AI error analysis...")
-    error_lines = analyze_error_with_ai(request.code, execution_result["output"])
+    start = time.perf_counter()
+    error_lines = await run_blocking(analyze_error_with_ai, request.code, execution_result["output"])
+    error_line_tiers.record("ai", time.perf_counter() - start)
     print("AI returned lines:", error_lines)
-    return {"error": error_lines, "result": execution_result["output"]}
+    return {"error": error_lines, "result": execution_result["output"], "profile": profile}
 
 # ---------------------------
 # Health Check
@@ -364,3 +2375,33 @@ async def code_interpreter(request: CodeRequest):
 @app.get("/health")
 def health():
     return {"status": "ok", "message": "Vercel FastAPI service active"}
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "latency_cache": latency_cache.stats(),
+        "sentiment_cache": sentiment_cache.stats(),
+        "sentiment_tiers": sentiment_tiers.stats(),
+        "outbound": {"retries": outbound.retries},
+        "coalescing": {
+            "comment": comment_flight.stats(),
+            "ask": ask_flight.stats(),
+            "audio": audio_flight.stats(),
+        },
+        "media_cache": media_cache.stats(),
+        "ask_jobs": ask_jobs.stats(),
+        "audio_stages": audio_stages.stats(),
+        "transcripts": {**transcript_stats, "cache": transcript_indexes.stats()},
+        "scratch": scratch.stats(),
+        "code_interpreter": {**code_pool.stats(), "error_lines": error_line_tiers.stats()},
+    }
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert q-vercel-latency.json into the binary telemetry store")
+    parser.add_argument("source", nargs="?", default="q-vercel-latency.json")
+    parser.add_argument("store", nargs="?", default=TELEMETRY_STORE)
+    args = parser.parse_args()
+    convert_telemetry(args.source, args.store)
+    print(f"Wrote telemetry store to {args.store}")
@@ -0,0 +1,63 @@
+"""
+Fire a burst of /code-interpreter requests at once and report throughput and
+tail latency, with a few runaway snippets mixed in to show they only cost
+their own worker, not everyone queued behind them.
+
+    python benchmarks/bench_code_interpreter.py --requests 200 --concurrency 32 --runaway 4
+"""
+import argparse
+import asyncio
+import time
+
+import httpx
+import numpy as np
+
+from common import load_api
+
+SNIPPET = "total = sum(i * i for i in range(20000))\nprint(total)"
+RUNAWAY = "while True:\n    pass"
+
+
+async def run(api, requests: int, concurrency: int, runaway: int) -> list:
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(client, code):
+        async with gate:
+            start = time.perf_counter()
+            response = await client.post("/code-interpreter", json={"code": code})
+            if code is SNIPPET:
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        codes = [RUNAWAY] * runaway + [SNIPPET] * requests
+        await asyncio.gather(*(one(client, code) for code in codes))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--runaway", type=int, default=2, help="infinite-loop snippets sent first")
+    args = parser.parse_args()
+
+    api = load_api()
+    # Failed snippets would otherwise go to the AI error analysis
+    api.analyze_error_with_ai = lambda code, traceback_str: []
+    api.code_pool.queue_limit = args.requests + args.runaway
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run(api, args.requests, args.concurrency, args.runaway))
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+    print(f"{len(latencies)} snippets in {elapsed:.2f}s ({len(latencies) / elapsed:.1f}/s), {args.runaway} runaway")
+    print(f"latency p50 {p50:.1f} ms  p95 {p95:.1f} ms  p99 {p99:.1f} ms")
+    print(api.code_pool.stats())
+
+
+if __name__ == "__main__":
+    main()
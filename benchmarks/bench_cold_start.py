@@ -0,0 +1,101 @@
+"""
+Cold-start cost per endpoint: each scenario runs in a fresh interpreter
+under `python -X importtime`, imports api/index.py and serves one request.
+Reports the module import, the imports the first request pulls in, the
+first request's wall time, and which heavy dependencies ended up loaded.
+FastAPI is imported before the clock starts, so "import ms" is the
+module's own cost on top of the framework.
+
+    python benchmarks/bench_cold_start.py --repeat 5
+    python benchmarks/bench_cold_start.py --scenarios health latency
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import ROOT
+
+HEAVY = ("numpy", "requests", "openai", "google.genai", "yt_dlp")
+
+# What each scenario does after the import; clients are built the way their endpoint builds them
+SCENARIOS = {
+    "health": 'client.get("/health")',
+    "metrics": 'client.get("/metrics")',
+    "latency": 'client.post("/", json={"regions": ["apac"], "threshold_ms": 180})',
+    "comment-local": 'client.post("/comment", json={"comment": "I love this, it is great and amazing"})',
+    "code-interpreter": 'client.post("/code-interpreter", json={"code": "print(1)"})',
+    "openai-client": "api.get_openai_client()",
+    "gemini-client": "api.get_gemini_client()",
+}
+
+CHILD = """
+import importlib, json, os, sys, time
+os.environ.setdefault("AIPIPE_TOKEN", "benchmark")
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+os.chdir({root!r})
+sys.path.insert(0, os.path.join({root!r}, "api"))
+from fastapi.testclient import TestClient
+print("--- import", file=sys.stderr, flush=True)
+start = time.perf_counter()
+api = importlib.import_module("index")
+imported = time.perf_counter()
+client = TestClient(api.app)
+print("--- request", file=sys.stderr, flush=True)
+start_request = time.perf_counter()
+{action}
+done = time.perf_counter()
+print("--- end", file=sys.stderr, flush=True)
+print(json.dumps({{
+    "import_ms": (imported - start) * 1e3,
+    "first_request_ms": (done - start_request) * 1e3,
+    "loaded": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def top_level_import_us(lines: list) -> int:
+    """Sum of cumulative time for top-level imports in a slice of -X importtime output."""
+    total = 0
+    for line in lines:
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # nested imports are already in their parent's cumulative
+            total += int(cumulative)
+    return total
+
+
+def run_scenario(action: str) -> dict:
+    script = CHILD.format(root=ROOT, action=action, heavy=HEAVY)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True, text=True, check=True, env=os.environ.copy(),
+    )
+    stderr = proc.stderr.splitlines()
+    marks = {line: i for i, line in enumerate(stderr) if line.startswith("--- ")}
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["request_imports_ms"] = top_level_import_us(stderr[marks["--- request"]:marks["--- end"]]) / 1e3
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per scenario (median reported)")
+    args = parser.parse_args()
+
+    print(f"{'scenario':>17} {'import ms':>10} {'req imports ms':>15} {'first req ms':>13}  heavy modules loaded")
+    for name in args.scenarios:
+        runs = [run_scenario(SCENARIOS[name]) for _ in range(args.repeat)]
+        import_ms = statistics.median(r["import_ms"] for r in runs)
+        request_imports_ms = statistics.median(r["request_imports_ms"] for r in runs)
+        first_ms = statistics.median(r["first_request_ms"] for r in runs)
+        loaded = ", ".join(runs[-1]["loaded"]) or "-"
+        print(f"{name:>17} {import_ms:10.1f} {request_imports_ms:15.1f} {first_ms:13.1f}  {loaded}")
+
+
+if __name__ == "__main__":
+    main()
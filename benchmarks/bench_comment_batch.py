@@ -0,0 +1,50 @@
+"""
+Compare one-comment-per-request /comment against /comment/batch, both
+pointed at a local OpenAI-compatible stub with a fixed upstream delay.
+
+    python benchmarks/bench_comment_batch.py --comments 500 --delay 0.05 --concurrency 32
+"""
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from common import load_api
+from stub_backends import serve_stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--comments", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.05, help="stub upstream latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    api = load_api()
+    base_url = serve_stub(args.delay) + "/v1"
+    api.openai_async_client = AsyncOpenAI(api_key="stub", base_url=base_url)
+    api.SENTIMENT_CONCURRENCY = args.concurrency
+    # Keep one portal (and so one event loop) open for the pooled async client
+    with TestClient(api.app) as client:
+        # Distinct comments, so the sentiment cache never answers for the stub
+        comments = [f"comment {i}" for i in range(args.comments)]
+        sequential_n = min(args.comments, 50)
+        start = time.perf_counter()
+        for comment in comments[:sequential_n]:
+            client.post("/comment", json={"comment": comment}).raise_for_status()
+        sequential = sequential_n / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = client.post("/comment/batch", json={"comments": comments[sequential_n:] or comments})
+        response.raise_for_status()
+        batch = len(response.json()["results"]) / (time.perf_counter() - start)
+        errors = sum(1 for item in response.json()["results"] if item["error"])
+
+    print(f"sequential /comment : {sequential:8.1f} comments/s")
+    print(f"/comment/batch      : {batch:8.1f} comments/s (concurrency {args.concurrency}, {errors} errors)")
+    print(f"speedup             : {batch / sequential:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Check that slow upstream work no longer stalls the event loop: N concurrent
+requests to each endpoint should finish in roughly the time of one. Exits
+non-zero when any endpoint's concurrent/single ratio exceeds --max-ratio,
+so a regression back to blocking calls fails the run.
+
+Upstreams are local stubs with a fixed delay:
+  /comment           - OpenAI-compatible stub server (async client)
+  /code-interpreter  - AIPipe Gemini stub server (requests.post, offloaded),
+                       reached through the AI error-line fallback
+  /ask               - blocking fake yt-dlp probe and download, and fake Gemini SDK client
+
+    python benchmarks/bench_concurrency.py --requests 16 --delay 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from types import SimpleNamespace
+
+import httpx
+from openai import AsyncOpenAI
+
+from common import load_api
+from stub_backends import serve_stub
+
+
+class FakeGemini:
+    """Stands in for genai.Client; every call blocks like the real SDK does."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.files = SimpleNamespace(upload=self._upload, get=self._get)
+        self.models = SimpleNamespace(generate_content=self._generate)
+
+    def _upload(self, path):
+        time.sleep(self.delay)
+        return SimpleNamespace(name="files/stub")
+
+    def _get(self, name):
+        return SimpleNamespace(name=name, state="ACTIVE", uri="stub://audio")
+
+    def _generate(self, contents, **kwargs):
+        time.sleep(self.delay)
+        prompt = contents[0]["parts"][-1]["text"]
+        if prompt.startswith("Transcribe"):
+            segments = [
+                {"start": "00:00:05", "text": "Welcome to the course introduction."},
+                {"start": "00:01:02", "text": "Next we install Python and set up uv."},
+            ]
+            return SimpleNamespace(text=json.dumps({"segments": segments}))
+        topics = re.findall(r"^\d+\. '", prompt, flags=re.M)
+        return SimpleNamespace(text=json.dumps({"timestamps": ["00:01:02"] * len(topics)}))
+
+
+async def fire(app, path: str, bodies: list) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.post(path, json=body) for body in bodies))
+        elapsed = time.perf_counter() - start
+    for response in responses:
+        response.raise_for_status()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--delay", type=float, default=0.5, help="stub upstream latency in seconds")
+    parser.add_argument("--max-ratio", type=float, default=2.0,
+                        help="fail if N concurrent requests take longer than this many single requests")
+    args = parser.parse_args()
+
+    # Point the app's disk caches at throwaway dirs, so every run starts cold and leaves /tmp alone
+    work_dir = tempfile.mkdtemp(prefix="bench-concurrency-")
+    for name in ("SCRATCH_DIR", "AUDIO_CACHE_DIR", "TRANSCRIPT_DIR"):
+        os.environ[name] = os.path.join(work_dir, name.lower())
+
+    api = load_api()
+    base_url = serve_stub(args.delay)
+    api.openai_async_client = AsyncOpenAI(api_key="stub", base_url=base_url + "/v1")
+    api.AIPIPE_GEMINI_URL = base_url + "/geminiv1beta/models/gemini-2.5-flash-lite:generateContent"
+    api.gemini_client = FakeGemini(args.delay)
+
+    def fake_download(url, out_dir, *download_args):
+        time.sleep(args.delay)
+        path = os.path.join(out_dir, "audio.mp3")
+        with open(path, "wb") as f:
+            f.write(b"\0" * 1024)
+        return path
+
+    def fake_probe(url, profile, timings=None):
+        return {"filesize": 1024, "duration": 1}
+
+    api.probe_audio = fake_probe
+    api.download_audio = fake_download
+
+    cases = {
+        "/comment": lambda i: {"comment": f"concurrent comment {i}"},
+        # A crashed worker leaves no traceback to read lines from, so this takes the AI fallback
+        "/code-interpreter": lambda i: {"code": f"import os\nos._exit({i % 100 + 1})"},
+        "/ask": lambda i: {"video_url": f"https://example.com/{i}", "topic": "intro"},
+    }
+    async def run_all() -> list:
+        # One event loop for everything, as under uvicorn
+        print(f"{'endpoint':>18} {'1 request (s)':>14} {f'{args.requests} concurrent (s)':>18} {'ratio':>7}")
+        failures = []
+        for path, body in cases.items():
+            single = await fire(api.app, path, [body(-1)])
+            concurrent = await fire(api.app, path, [body(i) for i in range(args.requests)])
+            ratio = concurrent / single
+            print(f"{path:>18} {single:>14.2f} {concurrent:>18.2f} {ratio:>6.1f}x")
+            if ratio > args.max_ratio:
+                failures.append(f"{path}: {args.requests} concurrent took {ratio:.1f}x one request")
+        return failures
+
+    try:
+        failures = asyncio.run(run_all())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if failures:
+        raise SystemExit("Concurrency regression (limit {:.1f}x):\n  {}".format(args.max_ratio, "\n  ".join(failures)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark suite for the latency endpoint (POST / in api/index.py).
+
+For each dataset size it generates synthetic telemetry, loads it through
+reload_telemetry() and measures:
+
+  direct    - RegionTelemetry.metrics() for every requested region
+  uncached  - POST / through the FastAPI test client, result cache cleared
+  cached    - POST / through the FastAPI test client, repeat identical body
+
+Results (throughput and p50/p95/p99 latency) are printed and saved as JSON,
+tagged with the git revision, so runs from different versions can be diffed.
+
+    python benchmarks/bench_latency_endpoint.py
+    python benchmarks/bench_latency_endpoint.py --rows 10000 100000 --regions 8 --services 6
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from common import ROOT, load_api, make_telemetry
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def measure(fn, requests: int) -> dict:
+    timings = np.empty(requests)
+    for i in range(requests):
+        start = time.perf_counter()
+        fn()
+        timings[i] = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99]) * 1e3
+    return {
+        "requests": requests,
+        "throughput_rps": round(requests / timings.sum(), 1),
+        "p50_ms": round(p50, 4),
+        "p95_ms": round(p95, 4),
+        "p99_ms": round(p99, 4),
+    }
+
+
+def bench_dataset(api, client: TestClient, rows: int, regions: int, services: int, requests: int) -> dict:
+    telemetry = make_telemetry(rows, regions=regions, services=services)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(telemetry, f)
+    del telemetry
+    try:
+        start = time.perf_counter()
+        api.reload_telemetry(f.name)
+        load = time.perf_counter() - start
+    finally:
+        os.unlink(f.name)
+
+    index = api.get_telemetry_index()
+    body = {"regions": sorted(index), "threshold_ms": 180}
+
+    def direct():
+        return {region: index[region].metrics(180) for region in body["regions"]}
+
+    def uncached():
+        api.latency_cache.clear()
+        response = client.post("/", json=body)
+        response.raise_for_status()
+
+    def cached():
+        response = client.post("/", json=body)
+        response.raise_for_status()
+
+    return {
+        "rows": rows,
+        "regions": regions,
+        "services": services,
+        "load_s": round(load, 4),
+        "direct": measure(direct, requests),
+        "uncached": measure(uncached, requests),
+        "cached": measure(cached, requests),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--services", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--output", help="JSON results path (default: benchmarks/results/latency-<rev>.json)")
+    args = parser.parse_args()
+
+    api = load_api()
+    client = TestClient(api.app)
+    revision = git_revision()
+
+    runs = []
+    print(f"{'rows':>10} {'scenario':>10} {'rps':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for rows in args.rows:
+        run = bench_dataset(api, client, rows, args.regions, args.services, args.requests)
+        runs.append(run)
+        for scenario in ("direct", "uncached", "cached"):
+            r = run[scenario]
+            print(f"{rows:>10} {scenario:>10} {r['throughput_rps']:>10} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}")
+
+    output = args.output or os.path.join(ROOT, "benchmarks", "results", f"latency-{revision}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"revision": revision, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": runs}, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compare the original full-scan aggregation in latency_metrics against the
+per-region columnar index.
+
+    python benchmarks/bench_latency_index.py
+    python benchmarks/bench_latency_index.py --rows 10000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from common import load_api, make_telemetry
+
+
+def legacy_latency_metrics(telemetry: list, regions: list, threshold: float) -> dict:
+    """The pre-index implementation: one full scan per requested region."""
+    results = {}
+    for region in regions:
+        region_data = [r for r in telemetry if r["region"] == region]
+        if not region_data:
+            continue
+        latencies = [r["latency_ms"] for r in region_data]
+        uptimes = [r["uptime_pct"] for r in region_data]
+        results[region] = {
+            "avg_latency": round(float(np.mean(latencies)), 2),
+            "p95_latency": round(float(np.percentile(latencies, 95)), 2),
+            "avg_uptime": round(float(np.mean(uptimes)), 3),
+            "breaches": sum(1 for l in latencies if l > threshold),
+        }
+    return results
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    api = load_api()
+    print(f"{'rows':>10} {'build (s)':>10} {'scan (ms)':>12} {'index (ms)':>12} {'speedup':>10}")
+    for rows in args.rows:
+        telemetry = make_telemetry(rows, regions=args.regions)
+        regions = sorted({r["region"] for r in telemetry})
+
+        start = time.perf_counter()
+        index = api.build_telemetry_index(telemetry)
+        build = time.perf_counter() - start
+
+        def indexed():
+            return {region: index[region].metrics(180) for region in regions if region in index}
+
+        assert indexed() == legacy_latency_metrics(telemetry, regions, 180)
+        scan = best_of(lambda: legacy_latency_metrics(telemetry, regions, 180), args.repeat)
+        fast = best_of(indexed, max(args.repeat, 100))
+        print(f"{rows:>10} {build:>10.3f} {scan * 1e3:>12.3f} {fast * 1e3:>12.4f} {scan / fast:>9.0f}x")
+        del telemetry, index
+
+
+if __name__ == "__main__":
+    main()
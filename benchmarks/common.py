@@ -0,0 +1,53 @@
+"""
+Shared helpers for the benchmark scripts: importing the Vercel app
+in-process and generating synthetic telemetry shaped like
+q-vercel-latency.json.
+"""
+import importlib
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REGIONS = ["apac", "emea", "amer", "latam", "africa", "mena", "anz", "nordics"]
+SERVICES = ["support", "checkout", "recommendations", "catalog", "analytics", "payments"]
+
+
+def load_api():
+    """Import api/index.py the way Vercel does (repo root as cwd)."""
+    # The API clients are built on first use and only need a value here
+    os.environ.setdefault("AIPIPE_TOKEN", "benchmark")
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.chdir(ROOT)
+    api_dir = os.path.join(ROOT, "api")
+    if api_dir not in sys.path:
+        sys.path.insert(0, api_dir)
+    return importlib.import_module("index")
+
+
+def make_telemetry(rows: int, regions: int = 3, services: int = 5, seed: int = 0) -> list:
+    """Synthetic telemetry records with the same keys and ranges as the sample file."""
+    rng = np.random.default_rng(seed)
+    region_names = REGIONS[:regions] + [f"region-{i}" for i in range(len(REGIONS), regions)]
+    service_names = SERVICES[:services] + [f"service-{i}" for i in range(len(SERVICES), services)]
+
+    region_idx = rng.integers(0, len(region_names), rows)
+    service_idx = rng.integers(0, len(service_names), rows)
+    latency = np.round(rng.gamma(9.0, 19.0, rows), 2)
+    uptime = np.round(rng.uniform(97.0, 99.5, rows), 3)
+    timestamp = 20250301 + rng.integers(0, 120, rows)
+
+    return [
+        {
+            "region": region_names[r],
+            "service": service_names[s],
+            "latency_ms": float(l),
+            "uptime_pct": float(u),
+            "timestamp": int(t),
+        }
+        for r, s, l, u, t in zip(
+            region_idx.tolist(), service_idx.tolist(), latency.tolist(), uptime.tolist(), timestamp.tolist()
+        )
+    ]
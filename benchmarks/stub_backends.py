@@ -0,0 +1,62 @@
+"""
+Local stand-ins for the upstream APIs api/index.py talks to, so benchmarks
+can run without network access or tokens. Each route sleeps for a
+configurable delay to mimic upstream latency.
+"""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+
+stub = FastAPI()
+stub.state.delay = 0.05
+
+
+@stub.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI-compatible chat completion returning a fixed sentiment."""
+    body = await request.json()
+    await asyncio.sleep(stub.state.delay)
+    text = body["messages"][-1]["content"]
+    content = {"sentiment": "negative", "rating": 1} if "fail" in text else {"sentiment": "positive", "rating": 5}
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": json.dumps(content)},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@stub.post("/geminiv1beta/models/{model_action}")
+async def gemini_generate_content(model_action: str, request: Request):
+    """Gemini generateContent (as proxied by AIPipe) pointing at line 1."""
+    await request.json()
+    await asyncio.sleep(stub.state.delay)
+    return {"candidates": [{"content": {"parts": [{"text": '{"error_lines": [1]}'}]}}]}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve_stub(delay: float = 0.05) -> str:
+    """Start the stub server on a background thread and return its base URL."""
+    stub.state.delay = delay
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
@@ -1,6 +1,16 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from array import array
+import bisect
 import csv
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
 
 app = FastAPI()
 
@@ -11,27 +21,178 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-After"],
 )
 
-# Read the CSV file once at startup
-students_data = []
-with open("q-fastapi.csv", newline='', encoding="utf-8") as csvfile:
-    reader = csv.DictReader(csvfile)
-    for row in reader:
-        # Convert studentId to int for proper typing
-        students_data.append({
-            "studentId": int(row["studentId"]),
-            "class": row["class"]
-        })
+CSV_PATH = "q-fastapi.csv"
+RELOAD_INTERVAL = float(os.getenv("STUDENTS_RELOAD_SECONDS", "5"))
+
+def make_etag(payload: bytes) -> str:
+    return '"' + hashlib.blake2b(payload, digest_size=16).hexdigest() + '"'
+
+class StudentStore:
+    """
+    Immutable, array-backed snapshot of q-fastapi.csv.
+
+    studentId lives in a typed array and class in small integer codes into an
+    interned table, instead of one dict per student. The roster is encoded to
+    JSON once; row offsets into that body let single rows and per-class
+    bodies be sliced out of it instead of being stored a second time.
+    """
+
+    PREFIX = b'{"students":['
+    SUFFIX = b']}'
+
+    def __init__(self, path: str):
+        self.mtime = os.stat(path).st_mtime_ns
+        self.ids = array("q")
+        self.class_codes = array("H")
+        self.classes = []  # code -> class name
+        codes = {}
+        with open(path, newline='', encoding="utf-8") as csvfile:
+            for row in csv.DictReader(csvfile):
+                code = codes.get(row["class"])
+                if code is None:
+                    code = codes[row["class"]] = len(self.classes)
+                    self.classes.append(row["class"])
+                self.ids.append(int(row["studentId"]))
+                self.class_codes.append(code)
+
+        self.codes = codes
+
+        # Row positions per class, in CSV order and in studentId order
+        self.class_positions = [array("I") for _ in self.classes]
+        for position, code in enumerate(self.class_codes):
+            self.class_positions[code].append(position)
+        self.id_order = array("I", sorted(range(len(self.ids)), key=self.ids.__getitem__))
+        self.class_id_order = [
+            array("I", sorted(positions, key=self.ids.__getitem__)) for positions in self.class_positions
+        ]
+
+        # Encode every row once; row_starts[p]..row_starts[p + 1] - 1 is row p in all_body
+        class_json = [json.dumps(name).encode() for name in self.classes]
+        encoded = [
+            b'{"studentId":%d,"class":%s}' % (student_id, class_json[code])
+            for student_id, code in zip(self.ids, self.class_codes)
+        ]
+        self.row_starts = array("I", itertools.accumulate((len(row) + 1 for row in encoded), initial=len(self.PREFIX)))
+        self.all_body = self.PREFIX + b",".join(encoded) + self.SUFFIX
+        del encoded
+        self.all_etag = make_etag(self.all_body)
+        self._body = memoryview(self.all_body)
+        self.class_etags = [make_etag(self.fragment(positions)) for positions in self.class_positions]
+
+    def row(self, position: int) -> bytes:
+        return self._body[self.row_starts[position]:self.row_starts[position + 1] - 1].tobytes()
+
+    def rows(self, positions):
+        return (self.row(p) for p in positions)
+
+    def fragment(self, positions) -> bytes:
+        """Comma-joined encoded rows, sliced out of the full body."""
+        body, starts = self._body, self.row_starts
+        return b",".join(body[starts[p]:starts[p + 1] - 1] for p in positions)
+
+    def page(self, codes, after, limit) -> tuple:
+        """
+        Encoded rows with studentId > after (in studentId order), and the next
+        cursor. Without a limit the rows come back as a lazy generator, so a
+        streamed response never holds the whole selection.
+        """
+        orders = [self.id_order] if codes is None else [self.class_id_order[c] for c in codes]
+        streams = []
+        for order in orders:
+            start = 0 if after is None else bisect.bisect_right(order, after, key=self.ids.__getitem__)
+            streams.append((self.ids[p], p) for p in itertools.islice(order, start, None))
+        merged = heapq.merge(*streams, key=lambda pair: pair[0])
+
+        if limit is None:
+            return (self.row(p) for _, p in merged), None
+        page = list(itertools.islice(merged, limit + 1))
+        next_after = page[limit - 1][0] if len(page) > limit else None
+        return [self.row(p) for _, p in page[:limit]], next_after
+
+# Read the CSV file once at startup; the watcher below swaps in a fresh
+# snapshot whenever the file's mtime changes, without restarting workers.
+store = StudentStore(CSV_PATH)
+
+def watch_csv():
+    global store
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            if os.stat(CSV_PATH).st_mtime_ns != store.mtime:
+                store = StudentStore(CSV_PATH)  # single reference assignment is atomic
+        except Exception as e:
+            # Keep serving the last good snapshot while the file is mid-write or invalid;
+            # anything escaping here would end the watcher thread for good
+            print("Roster reload failed:", e)
+
+if RELOAD_INTERVAL > 0:
+    threading.Thread(target=watch_csv, name="roster-reload", daemon=True).start()
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def ndjson_lines(rows):
+    for encoded in rows:
+        yield encoded + b"\n"
 
 @app.get("/api")
-def get_students(class_: list[str] = Query(None, alias="class")):
+def get_students(
+    class_: list[str] = Query(None, alias="class"),
+    limit: int = Query(None, ge=1),
+    after: int = Query(None),
+    accept: str = Header(None),
+    if_none_match: str = Header(None),
+):
     """
     Returns all students as JSON.
     If ?class=1A or ?class=1A&class=1B is specified,
-    returns only students in those classes.
+    returns only students in those classes, in CSV order.
+    Responds 304 when If-None-Match carries the current ETag.
+
+    ?limit=N&after=<studentId> pages through the selection in studentId order;
+    the JSON body carries "next_after" (null on the last page).
+    With "Accept: application/x-ndjson" students are streamed one per line,
+    and the next cursor is sent in the X-Next-After header.
     """
-    if class_:
-        filtered = [s for s in students_data if s["class"] in class_]
-        return {"students": filtered}
-    return {"students": students_data}
+    snapshot = store  # one consistent snapshot for the whole request
+    codes = [snapshot.codes[c] for c in dict.fromkeys(class_) if c in snapshot.codes] if class_ else None
+    ndjson = bool(accept) and "application/x-ndjson" in accept
+
+    if limit is not None or after is not None:
+        rows, next_after = snapshot.page(codes, after, limit)
+        if ndjson:
+            headers = {} if next_after is None else {"X-Next-After": str(next_after)}
+            return StreamingResponse(ndjson_lines(rows), media_type="application/x-ndjson", headers=headers)
+        body = b'{"students":[' + b",".join(rows) + b'],"next_after":' + json.dumps(next_after).encode() + b"}"
+        return Response(content=body, media_type="application/json")
+
+    if codes is not None:
+        # The body doesn't depend on the order classes are listed in, so neither does the ETag
+        etag = make_etag(",".join(snapshot.class_etags[c] for c in sorted(codes)).encode())
+    else:
+        etag = snapshot.all_etag
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    if codes is None:
+        positions = range(len(snapshot.ids))
+    else:
+        # Each class's positions are ascending, so merging them restores CSV order
+        positions = heapq.merge(*(snapshot.class_positions[c] for c in codes))
+
+    if ndjson:
+        return StreamingResponse(
+            ndjson_lines(snapshot.rows(positions)), media_type="application/x-ndjson", headers={"ETag": etag}
+        )
+
+    if codes is not None:
+        body = snapshot.PREFIX + snapshot.fragment(positions) + snapshot.SUFFIX
+    else:
+        body = snapshot.all_body
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})